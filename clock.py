@@ -67,15 +67,17 @@ More about clocks and time in the World
 from gi.repository import Gtk
 from gi.repository import Gdk
 from gi.repository import Gst
+from gi.repository import GLib
 from gi.repository import Rsvg
 from gi.repository import Pango
 from gi.repository import GObject
 from gi.repository import PangoCairo
 
 import os
-import re
 import math
+import time
 import cairo
+import logging
 import threading
 from datetime import datetime
 
@@ -108,6 +110,15 @@ POWERD_INHIBIT_DIR = '/var/run/powerd-inhibit-suspend'
 # hand +- the tolerance angle.
 _ANGLE_TOLERANCE = 0.3
 
+# The widths of the hands, and the radius of the disk at their center,
+# in line widths.
+_HAND_WIDTHS = {'hour': 9, 'minutes': 6, 'seconds': 2}
+_HAND_DISKS = {'hour': 5, 'minutes': 4, 'seconds': 3}
+
+# The ticks are scheduled this number of milliseconds after the
+# second, so that the timer never wakes up just before it.
+_TICK_DELAY_MS = 5
+
 
 class ClockActivity(activity.Activity):
     """The clock activity displays a simple clock widget.
@@ -144,7 +155,11 @@ class ClockActivity(activity.Activity):
 
         # Should we write the time in full letters?
         self._time_writer = None
+        # The threads writing the time create the TimeWriter only once
+        self._time_writer_lock = threading.Lock()
         self._time_in_letters = self.get_title()
+        # The same time, without the pango markup, to be spoken
+        self._time_spoken = self.get_title()
         self._time_letters = None
         self._date = None
         self._time_speaker = None
@@ -399,8 +414,9 @@ class ClockActivity(activity.Activity):
         the display of the time in full letters if the user has chosen
         to have it and eventually croak the time.
         """
-        # Change time display and talk, if necessary
-        self._write_and_speak(True)
+        # Change time display and talk, if necessary. In the
+        # background, the time is only written, not spoken.
+        self._write_and_speak(self._clock.active)
 
         # Update the weekday and date in case it was midnight
         self._date.set_markup(
@@ -441,11 +457,18 @@ class ClockActivity(activity.Activity):
     def _do_write_time(self):
         """Translate the time to full letters.
         """
-        if self._time_writer is None:
-            self._time_writer = TimeWriter()
+        with self._time_writer_lock:
+            if self._time_writer is None:
+                # The times are read from the times file built with the
+                # bundle for the language, when it has its rules. Otherwise
+                # the parsed rules are cached in the data directory of the
+                # activity to speed up the next starts.
+                self._time_writer = TimeWriter(
+                    cache_dir=os.path.join(activity.get_activity_root(), 'data'))
         hour = self._clock.get_time().hour
         minute = self._clock.get_time().minute
-        self._time_in_letters = self._time_writer.write_time(hour, minute)
+        self._time_in_letters, self._time_spoken = \
+            self._time_writer.write_time_texts(hour, minute)
         self._time_letters.set_markup(
             self._TIME_LETTERS_FORMAT % self._time_in_letters)
 
@@ -460,32 +483,129 @@ class ClockActivity(activity.Activity):
         if self._time_speaker is None:
             self._time_speaker = Speaker()
 
-        pipeline = 'espeak text="%(text)s" voice="%(voice)s" pitch="%(pitch)s" \
+        # The text is set on the element, not in the pipeline
+        # description, where its quotes would end the property value
+        pipeline = 'espeak name=espeak voice="%(voice)s" pitch="%(pitch)s" \
             rate="%(rate)s" gap="%(gap)s" ! autoaudiosink' % {
-            'text': self._untag(self._time_in_letters),
             'voice': self._time_speaker.VOICE,
             'pitch': self._time_speaker.PITCH,
             'rate': self._time_speaker.SPEED,
             'gap': self._time_speaker.WORD_GAP}
         try:
             pipe = Gst.parse_launch(pipeline)
+            pipe.get_by_name('espeak').set_property('text', self._time_spoken)
             bus = pipe.get_bus()
             bus.add_signal_watch()
             bus.connect('message', gstmessage_cb, pipe)
             pipe.set_state(Gst.State.PLAYING)
         except:
-            self._time_speaker.speak(self._untag(self._time_in_letters))
+            self._time_speaker.speak(self._time_spoken)
+
+
+class TickScheduler(object):
+    """Call a function just after each second, or each minute, of the
+    wall clock.
 
-    def _untag(self, text):
-        """Remove all the tags (pango markup) from a text.
+    The timer is armed again at each tick for the next second, so
+    that the ticks don't drift like with a periodic timer, and no
+    second is skipped or seen twice. A tick which comes too early is
+    delayed to its second. The lateness of the ticks is measured with
+    the monotonic clock, which does not jump when the time of the
+    system is changed.
+    """
+
+    def __init__(self, callback):
+        """Create a scheduler calling 'callback' at each tick. The
+        ticks stop when the callback returns False.
         """
-        if text is False or "<" not in text:
-            return text
-        else:
-            result = ""
-            for s in re.findall(r"(<.*?>)|([^<>]+)", text):
-                result += s[1]
-            return result
+        self._callback = callback
+        self._source = None
+        self._resolution = 1
+        # The wall clock time of the next tick, and the monotonic
+        # time when it is expected, in microseconds
+        self._target = 0
+        self._expected = 0
+        self.reset_stats()
+
+    def start(self, resolution=1):
+        """Start or restart the ticks, every 'resolution' seconds: 1
+        for each second, 60 for each minute.
+        """
+        self.stop()
+        self._resolution = resolution
+        self._arm()
+
+    def stop(self):
+        """Stop the ticks.
+        """
+        if self._source is not None:
+            GObject.source_remove(self._source)
+            self._source = None
+
+    def is_running(self):
+        """Tells if the ticks are scheduled.
+        """
+        return self._source is not None
+
+    def get_resolution(self):
+        """Gets the number of seconds between two ticks.
+        """
+        return self._resolution
+
+    def reset_stats(self):
+        """Forget the jitter statistics.
+        """
+        self._ticks = 0
+        self._early = 0
+        self._missed = 0
+        self._late_total = 0
+        self._late_max = 0
+
+    def get_stats(self):
+        """Gets the jitter statistics of the ticks since they were
+        reset: a dictionary with the number of ticks ("ticks"), the
+        mean and maximum delay after the expected time, in
+        milliseconds ("mean_ms", "max_ms"), the number of timers which
+        came too early ("early") and the number of ticks missed
+        because a timer came too late ("missed").
+        """
+        mean = 0.0
+        if self._ticks:
+            mean = self._late_total / 1000.0 / self._ticks
+        return {"ticks": self._ticks, "mean_ms": mean,
+                "max_ms": self._late_max / 1000.0,
+                "early": self._early, "missed": self._missed}
+
+    def _arm(self):
+        """Arm the timer for the next tick, just after the next
+        second or minute of the wall clock.
+        """
+        now = time.time()
+        self._target = (math.floor(now / self._resolution) + 1) * \
+            self._resolution
+        delay = int((self._target - now) * 1000) + _TICK_DELAY_MS
+        self._expected = GLib.get_monotonic_time() + delay * 1000
+        self._source = GObject.timeout_add(delay, self._tick_cb)
+
+    def _tick_cb(self):
+        """The timer of a tick is due.
+        """
+        self._source = None
+        if time.time() < self._target:
+            # Too early: the callback would see the previous second
+            self._early += 1
+            self._arm()
+            return False
+
+        late = max(GLib.get_monotonic_time() - self._expected, 0)
+        self._ticks += 1
+        self._late_total += late
+        self._late_max = max(self._late_max, late)
+        self._missed += int(late / 1000000.0 / self._resolution)
+
+        if self._callback():
+            self._arm()
+        return False
 
 
 class ClockFace(Gtk.DrawingArea):
@@ -517,12 +637,22 @@ class ClockFace(Gtk.DrawingArea):
         # resource
         self._active = False
 
+        # The ticks updating the clock: each second when it is
+        # active, each minute in the background.
+        self._ticks = TickScheduler(self._update_cb)
+
         # The display mode of the clock
         self._mode = _MODE_SIMPLE_CLOCK
 
         # Cache for the simple clock face background
         self._simple_background_cache = None
 
+        # Cache of the clock face background with the AM/PM indicator
+        # and the hour and minute hands, which only change once a
+        # minute, and what it was drawn with
+        self._hands_cache = None
+        self._hands_cache_key = None
+
         # SVG Background handle
         self._svg_handle = None
 
@@ -534,6 +664,11 @@ class ClockFace(Gtk.DrawingArea):
         self._hand_sizes = {}
         self._hand_angles = {}
 
+        # The hands angles and AM/PM indicator last drawn on the
+        # screen, to redraw only the areas where they changed. None
+        # when the whole clock must be redrawn.
+        self._drawn = None
+
         # Color codes (approved colors for XO screen:
         # http://wiki.laptop.org/go/XO_colors)
 
@@ -594,6 +729,7 @@ class ClockFace(Gtk.DrawingArea):
         'mode' is one of MODE_XXX_CLOCK constants.
         """
         self._mode = mode
+        self._drawn = None
 
     def _size_allocate_cb(self, widget, allocation):
         """We know the size of the widget on the screen, so we keep
@@ -612,10 +748,8 @@ class ClockFace(Gtk.DrawingArea):
                            int(allocation.height / 2.0)) - 20, 0)
         self._line_width = int(self._radius / 150)
 
-        cr = self.window.cairo_create()
-
         # Draw simple clock background
-        self._simple_background_cache = cr.get_target().create_similar(
+        self._simple_background_cache = self.window.create_similar_surface(
             cairo.CONTENT_COLOR_ALPHA, self._radius * 2,
             self._radius * 2)
         cache_ctx = cairo.Context(self._simple_background_cache)
@@ -626,7 +760,7 @@ class ClockFace(Gtk.DrawingArea):
         self._svg_handle = Rsvg.Handle(file="clock.svg")
 
         # Draw nice clock background
-        self._nice_background_cache = cr.get_target().create_similar(
+        self._nice_background_cache = self.window.create_similar_surface(
             cairo.CONTENT_COLOR_ALPHA, self._radius * 2,
             self._radius * 2)
         cache_ctx = cairo.Context(self._nice_background_cache)
@@ -641,6 +775,8 @@ class ClockFace(Gtk.DrawingArea):
         self._hand_sizes['minutes'] = self._radius * 0.8
         self._hand_sizes['seconds'] = self._radius * 0.7
 
+        self._drawn = None
+        self._hands_cache_key = None
         self.initialized = True
 
     def _draw_cb(self, widget, cr):
@@ -650,7 +786,8 @@ class ClockFace(Gtk.DrawingArea):
         In GTK+, widgets are double-buffered. It means that an
         off-screen buffer is automatically created to draw on it
         before the expose event is called and it prevents the screen
-        from flickering.
+        from flickering. All the drawing goes to the context 'cr' of
+        that buffer, clipped to the areas to redraw.
         """
         if not self.initialized and self.window:
             self.window = self.get_window()
@@ -658,18 +795,20 @@ class ClockFace(Gtk.DrawingArea):
 
         if self._active:
             if self._mode == _MODE_NICE_CLOCK:
-                self._draw_nice_clock()
+                self._draw_nice_clock(cr)
+                self._drawn = (dict(self._hand_angles), self._am_pm)
             elif self._mode == _MODE_SIMPLE_CLOCK:
-                self._draw_simple_clock()
+                self._draw_simple_clock(cr)
+                self._drawn = (dict(self._hand_angles), self._am_pm)
             elif self._mode == _MODE_DIGITAL_CLOCK:
-                self._draw_digital_clock()
+                self._draw_digital_clock(cr)
             else:
                 msg = "Unknown display mode: %d." % self._mode
                 raise ValueError(msg)
 
         return False
 
-    def _draw_markup(self, x, y, markup):
+    def _draw_markup(self, cr, x, y, markup):
         """Write the markup text given as parameter, centered on
         (x, y) coordinates.
 
@@ -678,24 +817,25 @@ class ClockFace(Gtk.DrawingArea):
         It allows to specify the fonts, colors and styles and to
         display rich text fully localizable.
         """
-        pango_context = self.get_pango_context()
-        layout = Pango.Layout(pango_context)
+        layout = PangoCairo.create_layout(cr)
 
         layout.set_markup(markup)
         layout.set_alignment(Pango.Alignment.CENTER)
 
-        x_bearing, y_bearing, width, height = layout.get_pixel_extents()[1][:4]
-        x_delta = int(x - width / 2 - x_bearing)
-        y_delta = int(y - height / 2 - y_bearing)
-        self.window.draw_layout(self._gc, x_delta, y_delta, layout)
+        logical = layout.get_pixel_extents()[1]
+        cr.save()
+        cr.move_to(int(x - logical.width / 2 - logical.x),
+                   int(y - logical.height / 2 - logical.y))
+        PangoCairo.show_layout(cr, layout)
+        cr.restore()
 
-    def _draw_digital_clock(self):
+    def _draw_digital_clock(self, cr):
         """Draw the digital clock.
         """
-        self._draw_time_scale()
-        self._draw_time()
+        self._draw_time_scale(cr)
+        self._draw_time(cr)
 
-    def _draw_time_scale(self):
+    def _draw_time_scale(self, cr):
         """Draw a time scale for digital clock.
         """
         # Draw scales of hours, minutes and seconds, to give the children
@@ -705,7 +845,6 @@ class ClockFace(Gtk.DrawingArea):
         seconds_length = 2 * self._radius / 60 * self._time.second
 
         # Fill background
-        cr = self.window.cairo_create()
         cr.set_source_rgba(*style.Color(self._COLOR_WHITE).get_rgba())
         cr.rectangle(round(self._center_x - 1.1 * self._radius),
                      round(self._center_y - 0.85 * self._radius),
@@ -734,7 +873,7 @@ class ClockFace(Gtk.DrawingArea):
         cr.rectangle(x, y, seconds_length, h)
         cr.fill()
 
-    def _draw_time(self):
+    def _draw_time(self, cr):
         """Draw the time in colors (digital display).
         """
         # TRANS: The format used to display the time for digital clock
@@ -754,18 +893,18 @@ class ClockFace(Gtk.DrawingArea):
         markup_time = self._time.strftime(markup)
         # markup_time = time.strftime(markup)
 
-        cr = self.window.cairo_create()
+        cr.save()
         cr.set_source_rgba(*style.Color(self._COLOR_BLACK).get_rgba())
-        pango_layout = PangoCairo.create_layout(
-            PangoCairo.create_context(cr))
+        pango_layout = PangoCairo.create_layout(cr)
         d = int(self._center_y + 0.3 * self._radius)
         pango_layout.set_markup(markup_time)
         dx, dy = pango_layout.get_pixel_size()
         pango_layout.set_alignment(Pango.Alignment.CENTER)
         cr.translate(self._center_x - dx / 2.0, d - dy / 2.0)
         PangoCairo.show_layout(cr, pango_layout)
+        cr.restore()
 
-    def _draw_simple_clock(self):
+    def _draw_simple_clock(self, cr):
         """Draw the simple clock variants.
         """
 
@@ -773,14 +912,7 @@ class ClockFace(Gtk.DrawingArea):
         if self._simple_background_cache is None:
             return
 
-        # Place the simple background
-        cr = self.window.cairo_create()
-        cr.translate(self._center_x - self._radius,
-                     self._center_y - self._radius)
-        cr.set_source_surface(self._simple_background_cache)
-        cr.paint()
-
-        self._draw_hands()
+        self._draw_analog_clock(cr, self._simple_background_cache)
 
     def _draw_simple_background(self, cr):
         """Draw the background of the simple clock.
@@ -818,37 +950,62 @@ class ClockFace(Gtk.DrawingArea):
                        int(self._radius + (self._radius - 6) * sin))
             cr.stroke()
 
-    def _draw_nice_background(self):
-        """Draw the nice clock background.
+    def _draw_nice_clock(self, cr):
+        """Draw the nice clock.
 
         The background has been loaded from the clock.svg file to a
-        rsvg handle, and we just transform this handle and render it
-        with cairo.
+        rsvg handle, and rendered once in a cache.
+        """
+        self._draw_analog_clock(cr, self._nice_background_cache)
+
+    def _draw_analog_clock(self, cr, background):
+        """Draw an analog clock on a background cache.
+
+        The background, the AM/PM indicator and the hour and minute
+        hands are painted at once from a cache, drawn again only when
+        they change. Only the seconds hand is drawn each second.
         """
-        # Place the nice background
-        cr = self.window.cairo_create()
+        cr.save()
         cr.translate(self._center_x - self._radius,
                      self._center_y - self._radius)
-        cr.set_source_surface(self._nice_background_cache)
+        cr.set_source_surface(self._get_hands_cache(background))
         cr.paint()
+        cr.restore()
 
-    def _draw_nice_clock(self):
-        """Draw the nice clock.
-        """
-        self._draw_nice_background()
-        self._draw_hands()
-
-    def _draw_hands(self):
-        """Draw the hands of the analog clocks.
-        """
-        cr = self.window.cairo_create()
+        cr.save()
         cr.set_line_cap(cairo.LINE_CAP_ROUND)
+        self._draw_seconds_hand(cr)
+        cr.restore()
 
+    def _get_hands_cache(self, background):
+        """Gets the cache of the background with the AM/PM indicator
+        and the hour and minute hands, drawing it again if they
+        changed since it was drawn.
+        """
+        key = (background, self._am_pm, self._hand_angles['hour'],
+               self._hand_angles['minutes'])
+        if self._hands_cache_key != key:
+            self._hands_cache = self.window.create_similar_surface(
+                cairo.CONTENT_COLOR_ALPHA, self._radius * 2,
+                self._radius * 2)
+            cache_ctx = cairo.Context(self._hands_cache)
+            cache_ctx.set_source_surface(background)
+            cache_ctx.paint()
+            # The hands are drawn from the center of the widget
+            cache_ctx.translate(self._radius - self._center_x,
+                                self._radius - self._center_y)
+            cache_ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+            self._draw_hour_minute_hands(cache_ctx)
+            self._hands_cache_key = key
+        return self._hands_cache
+
+    def _draw_hour_minute_hands(self, cr):
+        """Draw the AM/PM indicator and the hour and minute hands of
+        the analog clocks.
+        """
         # AM/PM indicator:
-        pangocairo_context = PangoCairo.CairoContext(cr)
-        pangocairo_context.set_source_rgba(
-            *style.Color(self._COLOR_HOURS).get_rgba())
-        pango_layout = pangocairo_context.create_layout()
+        cr.set_source_rgba(*style.Color(self._COLOR_HOURS).get_rgba())
+        pango_layout = PangoCairo.create_layout(cr)
         if self._am_pm == 'AM':
             am_pm = _('<markup><span lang="en" font_desc="Sans Bold 28">\
 <span foreground="white" background="black"> AM </span><span \
@@ -857,23 +1014,23 @@ foreground="lightgray"> PM </span></span></markup>')
             am_pm = _('<markup><span lang="en" font_desc="Sans Bold 28">\
 <span foreground="lightgray"> AM </span><span foreground="white" \
 background="black"> PM </span></span></markup>')
-        pangocairo_context.save()
+        cr.save()
         pango_layout.set_markup(am_pm)
         self.am_pm_width, self.am_pm_height = pango_layout.get_pixel_size()
-        pangocairo_context.translate(- self.am_pm_width / 2.0 + self._center_x,
-                                     - self.am_pm_height / 2.0 +
-                                     (self._radius / 3) + self._center_y)
-        pangocairo_context.update_layout(pango_layout)
-        pangocairo_context.show_layout(pango_layout)
-        pangocairo_context.restore()
+        cr.translate(- self.am_pm_width / 2.0 + self._center_x,
+                     - self.am_pm_height / 2.0 +
+                     (self._radius / 3) + self._center_y)
+        PangoCairo.update_layout(cr, pango_layout)
+        PangoCairo.show_layout(cr, pango_layout)
+        cr.restore()
 
         # Hour hand:
         # The hour hand is rotated 30 degrees (pi/6 r) per hour +
         # 1/2 a degree (pi/360) per minute
         cr.set_source_rgba(*style.Color(self._COLOR_HOURS).get_rgba())
-        cr.set_line_width(9 * self._line_width)
+        cr.set_line_width(_HAND_WIDTHS['hour'] * self._line_width)
         cr.arc(self._center_x, self._center_y,
-               5 * self._line_width, 0, 2 * math.pi)
+               _HAND_DISKS['hour'] * self._line_width, 0, 2 * math.pi)
         cr.fill_preserve()
         cr.move_to(self._center_x, self._center_y)
         sin = math.sin(self._hand_angles['hour'])
@@ -886,9 +1043,9 @@ background="black"> PM </span></span></markup>')
         # Minute hand:
         # The minute hand is rotated 6 degrees (pi/30 r) per minute
         cr.set_source_rgba(*style.Color(self._COLOR_MINUTES).get_rgba())
-        cr.set_line_width(6 * self._line_width)
+        cr.set_line_width(_HAND_WIDTHS['minutes'] * self._line_width)
         cr.arc(self._center_x, self._center_y,
-               4 * self._line_width, 0, 2 * math.pi)
+               _HAND_DISKS['minutes'] * self._line_width, 0, 2 * math.pi)
         cr.fill_preserve()
         cr.move_to(self._center_x, self._center_y)
         sin = math.sin(self._hand_angles['minutes'])
@@ -897,12 +1054,15 @@ background="black"> PM </span></span></markup>')
                    int(self._center_y - self._hand_sizes['minutes'] * cos))
         cr.stroke()
 
+    def _draw_seconds_hand(self, cr):
+        """Draw the seconds hand of the analog clocks.
+        """
         # Seconds hand:
         # Operates identically to the minute hand
         cr.set_source_rgba(*style.Color(self._COLOR_SECONDS).get_rgba())
-        cr.set_line_width(2 * self._line_width)
+        cr.set_line_width(_HAND_WIDTHS['seconds'] * self._line_width)
         cr.arc(self._center_x, self._center_y,
-               3 * self._line_width, 0, 2 * math.pi)
+               _HAND_DISKS['seconds'] * self._line_width, 0, 2 * math.pi)
         cr.fill_preserve()
         cr.move_to(self._center_x, self._center_y)
         sin = math.sin(self._hand_angles['seconds'])
@@ -914,9 +1074,8 @@ background="black"> PM </span></span></markup>')
     def _draw_numbers(self, cr):
         """Draw the numbers of the hours.
         """
-        cr = PangoCairo.CairoContext(cr)
         cr.set_source_rgba(*style.Color(self._COLOR_HOURS).get_rgba())
-        pango_layout = cr.create_layout()
+        pango_layout = PangoCairo.create_layout(cr)
 
         for i in xrange(12):
             # TRANS: The format of the font used to print hour
@@ -930,20 +1089,66 @@ font_desc="Sans Bold 40">%d</span></markup>') % (i + 1)
                          self._radius * math.cos((i - 2) * math.pi / 6.0),
                          - dy / 2.0 + self._radius + 0.75 * self._radius *
                          math.sin((i - 2) * math.pi / 6.0))
-            cr.update_layout(pango_layout)
-            cr.show_layout(pango_layout)
+            PangoCairo.update_layout(cr, pango_layout)
+            PangoCairo.show_layout(cr, pango_layout)
             cr.restore()
 
-    def _redraw_canvas(self):
+    def _redraw_canvas(self, areas=None):
         """Force a redraw of the clock on the screen.
+        'areas' is the list of the rectangles (x, y, width, height) to
+        redraw, or None to redraw the whole clock.
         """
         # If we are attached to a window, redraw ourself.
         if self.window:
-            self.queue_draw()
+            if areas is None:
+                self.queue_draw()
+            else:
+                for x, y, width, height in areas:
+                    self.queue_draw_area(x, y, width, height)
             self.window.process_updates(True)
 
+    def _damaged_areas(self):
+        """Gets the rectangles of the analog clock where the hands or
+        the AM/PM indicator changed since they were last drawn: the
+        rectangles covering the old and new positions of each hand
+        which moved, and the AM/PM indicator when it changed.
+        Returns None when the whole clock must be redrawn.
+        """
+        if self._drawn is None or self._mode == _MODE_DIGITAL_CLOCK:
+            return None
+        angles, am_pm = self._drawn
+        areas = []
+        for hand, angle in angles.items():
+            if self._hand_angles[hand] != angle:
+                areas.append(self._hand_area(hand, angle))
+                areas.append(self._hand_area(hand, self._hand_angles[hand]))
+        if am_pm != self._am_pm:
+            areas.append((
+                int(self._center_x - self.am_pm_width / 2.0) - 1,
+                int(self._center_y + self._radius / 3 -
+                    self.am_pm_height / 2.0) - 1,
+                self.am_pm_width + 2, self.am_pm_height + 2))
+        return areas
+
+    def _hand_area(self, hand, angle):
+        """Gets the rectangle (x, y, width, height) covered by a hand
+        drawn with an angle, with its round end and the disk at its
+        center.
+        """
+        x = int(self._center_x + self._hand_sizes[hand] * math.sin(angle))
+        y = int(self._center_y - self._hand_sizes[hand] * math.cos(angle))
+        # One more pixel for the antialiasing
+        margin = int(math.ceil(max(_HAND_WIDTHS[hand] / 2.0,
+                                   _HAND_DISKS[hand]) *
+                               self._line_width)) + 1
+        left = min(x, self._center_x) - margin
+        top = min(y, self._center_y) - margin
+        return (left, top, max(x, self._center_x) + margin - left,
+                max(y, self._center_y) + margin - top)
+
     def _update_cb(self):
-        """Called every seconds to update the time value.
+        """Called every seconds, or every minutes in the background, to
+        update the time value.
         """
         # update the time and force a redraw of the clock
         self._time = datetime.now()
@@ -959,20 +1164,21 @@ font_desc="Sans Bold 40">%d</span></markup>') % (i + 1)
         else:
             self._am_pm = 'PM'
 
-        GObject.idle_add(self._redraw_canvas)
+        # Only the areas where the hands moved are redrawn
+        if self._active:
+            GObject.idle_add(self._redraw_canvas, self._damaged_areas())
 
         # When the minutes change, we raise the 'time_minute'
-        # signal. We can't test on 'self._time.second == 0' for
-        # instance because Gtk timer does not guarantee to call us
-        # every seconds.
+        # signal. The ticks come just after each second, but a tick
+        # can still be missed when the system is busy, so we don't
+        # test on 'self._time.second == 0'.
         if self._old_minute != self._time.minute:
             self.emit("time_minute")
             self._old_minute = self._time.minute
 
-        # Keep running this timer as long as the clock is active
-        # (ie. visible) or the mode changes to dragging the hands of
-        # the clock
-        return self._active and not self.grab_hands_mode
+        # Keep running the ticks until the mode changes to dragging
+        # the hands of the clock
+        return not self.grab_hands_mode
 
     def _get_time_from_hands_angles(self):
         """Uses the angles of the hands to generate hours and minute
@@ -1016,17 +1222,29 @@ font_desc="Sans Bold 40">%d</span></markup>') % (i + 1)
 
     def _set_active(self, active):
         """Set the activity state of the clock face. When Sugar
-        reactivates the clock, we start a timer to be called every
-        seconds and update the clock.
+        reactivates the clock, the clock is updated every second.
+        Otherwise, it is only updated every minute, for the time in
+        full letters, and neither redrawn nor spoken.
         """
         self._active = active
 
         if active:
             # We must redraw the clock...
             self._update_cb()
+        else:
+            logging.debug("Clock ticks: %s", self._ticks.get_stats())
+            self._ticks.reset_stats()
+
+        if not self.grab_hands_mode:
+            self._ticks.start(self._get_tick_resolution())
 
-            # And update again the clock every seconds.
-            GObject.timeout_add(1000, self._update_cb)
+    def _get_tick_resolution(self):
+        """Gets the number of seconds between the updates of the
+        clock: 1 when the seconds are displayed, 60 in the background.
+        """
+        if self._active:
+            return 1
+        return 60
 
     active = property(_get_active, _set_active)
 
@@ -1050,6 +1268,9 @@ font_desc="Sans Bold 40">%d</span></markup>') % (i + 1)
             self._release_id = self.connect("button-release-event",
                                             self._release_cb)
 
+            # The hands show the time set by the user
+            self._ticks.stop()
+
             # Put hand cursor
             self.window.set_cursor(Gtk.gdk.Cursor(Gtk.gdk.HAND2))
 
@@ -1062,7 +1283,7 @@ font_desc="Sans Bold 40">%d</span></markup>') % (i + 1)
             self.window.set_cursor(Gtk.gdk.Cursor(Gtk.gdk.LEFT_PTR))
 
             # Update again the clock every seconds.
-            GObject.timeout_add(1000, self._update_cb)
+            self._ticks.start(self._get_tick_resolution())
 
         self.emit("time_minute")
 
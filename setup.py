@@ -1,8 +1,29 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+
+import timewriter
+
+
+def build_times(build_locale):
+    """Wrap the build of the locale directory of the bundle, to also write the
+    times file of the rules of each translation in its locale directory. The
+    activity then reads the times instead of parsing the rules when it starts.
+    """
+    def build(builder):
+        build_locale(builder)
+        left_out = timewriter.build_locale_times(
+            os.path.join(builder.config.source_dir, 'po'), builder.locale_dir)
+        if left_out:
+            print "Time rules not valid, parsed when the activity starts: %s" % \
+                " ".join(left_out)
+    return build
+
+
 try:
-    from sugar.activity import bundlebuilder
+    from sugar3.activity import bundlebuilder
+    bundlebuilder.Builder.build_locale = build_times(bundlebuilder.Builder.build_locale)
     bundlebuilder.start()
 except ImportError:
-    print "Error: sugar.activity.Bundlebuilder not found."
+    print "Error: sugar3.activity.bundlebuilder not found."
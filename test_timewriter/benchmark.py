@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+#
+# Code released in the Public Domain. You can do whatever you want with this package.
+# Look at README file to see how to adapt this program.
+# Originally written by Pierre Métras <pierre@alterna.tv> for the OLPC XO laptop.
+
+"""Benchmarks of the timewriter engine.
+
+For each set of rules, from the test_timewriter modules (en, es, fr) and from the
+translations in the po/ directory, we measure:
+- parse_ms: the time to parse the rules with TimeWriter.parse_rules(), in ms;
+- write_time_us: the percentiles (p50, p90, p99) of the latency of write_time()
+  for all the times of the day, in µs. The latency of a time is the average of
+  a loop of calls writing that time;
+- sweep_per_s: the number of times written per second by write_times() for a
+  whole day, from freshly parsed rules;
+- peak_rss_kb: the growth of the peak memory of the process while loading the
+  rules and writing all the times, in KB;
+- rules_kb: the memory size of the parsed rules, from TimeWriter.rules_info(),
+  in KB.
+
+Each set of rules is measured in its own process, so that the memory of a set
+does not hide the one of the next sets. The garbage collector is disabled while
+timing. Each timing is a loop long enough for the resolution of the timer not to
+matter, repeated after a warm up, and the median of the repetitions is kept: a
+single slow or fast repetition does not move it. All the sets are measured
+several times, in new processes, one run after the other, and each metric is
+the median of the runs, so that a slow minute of a shared or virtual machine
+only changes one of them.
+
+The results are written as JSON and compared with a baseline file, saved from
+the same medians. A result worse than the baseline by more than the relative
+tolerance is reported as a regression. The baseline depends on the machine:
+save a new one with --save-baseline when changing of machine.
+
+Usage, from the activity directory:
+    python -m test_timewriter.benchmark [options]
+"""
+
+import gc
+import os
+import sys
+import json
+import glob
+import timeit
+import resource
+import platform
+import optparse
+import multiprocessing
+
+import timewriter
+
+
+# Version of the results format
+_FORMAT_VERSION = 1
+
+# Directory of the activity
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Default baseline file
+_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# The languages of the test_timewriter modules
+_TEST_LANGUAGES = ["en", "es", "fr"]
+
+# Number of repetitions of the timed loops; the median one is kept
+_REPEAT = 7
+
+# Minimum duration of a timed loop, in seconds. The timer can't resolve less than
+# about one µs on some systems.
+_MIN_LOOP_TIME = 0.02
+
+# Number of calls of write_time() for the same time, timed together
+_LATENCY_CALLS = 20
+
+# Number of runs of all the sets of rules; the median of each metric is kept
+_RUNS = 3
+
+# Default relative tolerance before reporting a regression. The speed of a shared
+# or virtual machine changes by up to about twice from one minute to the next,
+# even for the medians.
+_TOLERANCE = 1.0
+
+# Metrics where a higher value is better. For all the others, lower is better.
+_HIGHER_IS_BETTER = ["sweep_per_s"]
+
+# Smallest difference reported as a regression for some metrics, in their unit.
+# The peak memory grows by whole blocks of the allocator.
+_SLACK = {"peak_rss_kb": 256}
+
+
+def rule_sets(po_dir=None):
+    """Gets the sets of rules to benchmark.
+    Returns a list of (name, source), with the test rules first, then the valid
+    rules of the translations of 'po_dir' when given. Translations with syntax
+    errors or missing rules are ignored, as they can't write all the times.
+    """
+    sets = []
+    for lang in _TEST_LANGUAGES:
+        module = __import__("test_timewriter.%s_rules" % lang, fromlist=["_time_rules"])
+        sets.append(("test/" + lang, module._time_rules))
+    if po_dir is not None:
+        for path in sorted(glob.glob(os.path.join(po_dir, "*.po"))):
+            source = timewriter.read_po_rules(path)
+            if source is None:
+                continue
+            report = timewriter.validate_rules(source)
+            if report["syntax_error"] is None and not report["errors"]:
+                lang = os.path.splitext(os.path.basename(path))[0]
+                sets.append(("po/" + lang, source))
+    return sets
+
+
+def _median(values):
+    """Gets the median of a list of numbers.
+    """
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _percentile(samples, q):
+    """Gets the q-th quantile (0 <= q <= 1) of sorted samples.
+    """
+    return samples[int(round(q * (len(samples) - 1)))]
+
+
+def _all_times():
+    """Gets the list of all the (hour, minute) of a day.
+    """
+    return [(h, m) for h in range(0, 24) for m in range(0, 60)]
+
+
+def _time_loop(function, setup=None):
+    """Time the calls of a function, in a loop lasting at least _MIN_LOOP_TIME.
+    'setup', when given, is called before each loop, not timed.
+    Returns the median duration of a call over _REPEAT loops, in seconds.
+    """
+    timer = timeit.default_timer
+    # Find the number of calls lasting long enough, also warming up
+    number = 1
+    while True:
+        if setup is not None:
+            setup()
+        start = timer()
+        for i in xrange(number):
+            function()
+        if timer() - start >= _MIN_LOOP_TIME:
+            break
+        number *= 2
+
+    durations = []
+    for i in range(_REPEAT):
+        if setup is not None:
+            setup()
+        start = timer()
+        for j in xrange(number):
+            function()
+        durations.append((timer() - start) / number)
+    return _median(durations)
+
+
+def measure(source):
+    """Benchmark a set of rules. Runs in a child process.
+    Returns the dictionary of the metrics.
+    """
+    timer = timeit.default_timer
+    peak_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    day = _all_times()
+
+    writer = timewriter.TimeWriter()
+    gc.disable()
+    parse_seconds = _time_loop(lambda: writer.parse_rules(source))
+
+    # Latency of each time: the median of the loops of calls for that time
+    writer.parse_rules(source)
+    writer.write_times(day)
+    loops = [[] for time in day]
+    calls = range(_LATENCY_CALLS)
+    for i in range(_REPEAT):
+        for j, (hour, minute) in enumerate(day):
+            start = timer()
+            for k in calls:
+                writer.write_time(hour, minute)
+            loops[j].append((timer() - start) / _LATENCY_CALLS)
+    samples = sorted([_median(durations) for durations in loops])
+
+    sweep_seconds = _time_loop(lambda: writer.write_times(day), lambda: writer.parse_rules(source))
+    gc.enable()
+
+    peak_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"parse_ms": round(parse_seconds * 1000, 3),
+            "write_time_us": {"p50": round(_percentile(samples, 0.5) * 1e6, 2),
+                              "p90": round(_percentile(samples, 0.9) * 1e6, 2),
+                              "p99": round(_percentile(samples, 0.99) * 1e6, 2)},
+            "sweep_per_s": int(len(day) / sweep_seconds),
+            "peak_rss_kb": peak_end - peak_start,
+            "rules_kb": round(writer.rules_info()["size"] / 1024.0, 1)}
+
+
+def _measure_set(rule_set):
+    """Benchmark a (name, source) set of rules. Used by the process pool.
+    """
+    return rule_set[0], measure(rule_set[1])
+
+
+def _median_metrics(runs):
+    """Gets the median of each metric of the results of many runs of a set of
+    rules, with the same rounding as the metrics.
+    """
+    first = runs[0]
+    metrics = {}
+    for name, value in first.items():
+        if isinstance(value, dict):
+            metrics[name] = _median_metrics([run[name] for run in runs])
+        elif isinstance(value, float):
+            metrics[name] = round(_median([run[name] for run in runs]), 3)
+        else:
+            metrics[name] = int(_median([run[name] for run in runs]))
+    return metrics
+
+
+def run(po_dir=None, runs=_RUNS):
+    """Benchmark all the sets of rules, one after the other, each one in a new
+    process. All the sets are benchmarked 'runs' times, and the median of each
+    metric is kept.
+    Returns the results, to be saved as JSON.
+    """
+    sets = rule_sets(po_dir)
+    measures = {}
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for i in range(runs):
+            for name, metrics in pool.map(_measure_set, sets, chunksize=1):
+                measures.setdefault(name, []).append(metrics)
+    finally:
+        pool.close()
+        pool.join()
+    return {"version": _FORMAT_VERSION,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "runs": runs,
+            "results": dict((name, _median_metrics(metrics)) for name, metrics in measures.items())}
+
+
+def _flatten(metrics, prefix=""):
+    """Gets the metrics as a flat dictionary {"write_time_us.p50": value...}.
+    """
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + name + "."))
+        else:
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Compare the results with the baseline.
+    A metric is a regression when it is worse than the baseline by more than
+    'tolerance' (0.5 means 50% slower, or 1.5 times less per second), and by
+    more than its slack.
+    Returns the list of the regressions messages.
+    """
+    regressions = []
+    for name, metrics in sorted(results["results"].items()):
+        if name not in baseline["results"]:
+            continue
+        reference = _flatten(baseline["results"][name])
+        for metric, value in sorted(_flatten(metrics).items()):
+            if metric not in reference or reference[metric] <= 0:
+                continue
+            group = metric.split(".")[0]
+            ratio = float(value) / reference[metric]
+            if group in _HIGHER_IS_BETTER:
+                worse = ratio < 1 / (1 + tolerance)
+            else:
+                worse = ratio > 1 + tolerance and value - reference[metric] > _SLACK.get(group, 0)
+            if worse:
+                regressions.append("%s %s: %s (baseline %s)" % (name, metric, value, reference[metric]))
+    return regressions
+
+
+def print_results(results):
+    """Print the results as a table.
+    """
+    print "%-12s %9s %9s %9s %9s %10s %9s %9s" % (
+        "rules", "parse ms", "p50 us", "p90 us", "p99 us", "times/s", "peak KB", "rules KB")
+    for name, metrics in sorted(results["results"].items()):
+        latency = metrics["write_time_us"]
+        print "%-12s %9.3f %9.2f %9.2f %9.2f %10d %9d %9.1f" % (
+            name, metrics["parse_ms"], latency["p50"], latency["p90"], latency["p99"],
+            metrics["sweep_per_s"], metrics["peak_rss_kb"], metrics["rules_kb"])
+
+
+def main():
+    """Run the benchmarks and compare them with the baseline.
+    """
+    parser = optparse.OptionParser(usage="python -m test_timewriter.benchmark [options]")
+    parser.add_option("-o", "--output", help="write the results as JSON to OUTPUT")
+    parser.add_option("-b", "--baseline", default=_BASELINE,
+                      help="baseline results [default: %default]")
+    parser.add_option("--save-baseline", action="store_true", default=False,
+                      help="save the results as the new baseline")
+    parser.add_option("-t", "--tolerance", type="float", default=_TOLERANCE,
+                      help="allowed slow down before reporting a regression [default: %default]")
+    parser.add_option("--no-po", action="store_true", default=False,
+                      help="only benchmark the test rules, not the translations")
+    parser.add_option("-r", "--runs", type="int", default=_RUNS,
+                      help="runs of all the rules, whose median is kept [default: %default]")
+    options, args = parser.parse_args()
+
+    po_dir = None
+    if not options.no_po:
+        po_dir = os.path.join(_ROOT_DIR, "po")
+    results = run(po_dir, options.runs)
+    print_results(results)
+
+    if options.output:
+        f = open(options.output, "w")
+        try:
+            json.dump(results, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+
+    if options.save_baseline:
+        f = open(options.baseline, "w")
+        try:
+            json.dump(results, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        print "\nBaseline saved in %s" % options.baseline
+        return
+
+    if not os.path.exists(options.baseline):
+        print "\nNo baseline %s to compare with." % options.baseline
+        return
+    f = open(options.baseline)
+    try:
+        baseline = json.load(f)
+    finally:
+        f.close()
+    regressions = compare(results, baseline, options.tolerance)
+    if regressions:
+        print "\n***** Regressions *****"
+        for regression in regressions:
+            print regression
+        sys.exit(1)
+    print "\nNo regression compared with %s" % options.baseline
+
+
+if __name__ == "__main__":
+    main()
@@ -18,30 +18,8 @@ _time_rules = """
     hour(1) => une heure |
     hour(12) => midi |
     hour(h) => number(h) heures |
-    hour1(0) => une heure |
-    hour1(1) => deux heures |
-    hour1(2) => trois heures |
-    hour1(3) => quatre heures |
-    hour1(4) => cinq heures |
-    hour1(5) => six heures |
-    hour1(6) => sept heures |
-    hour1(7) => huit heures |
-    hour1(8) => neuf heures |
-    hour1(9) => dix heures |
-    hour1(10) => onze heures |
-    hour1(11) => midi |
-    hour1(12) => treize heures |
-    hour1(13) => quatorze heures |
-    hour1(14) => quinze heures |
-    hour1(15) => seize heures |
-    hour1(16) => dix-sept heures |
-    hour1(17) => dix-huit heures |
-    hour1(18) => dix-neuf heures |
-    hour1(19) => vingt heures |
-    hour1(20) => vingt-et-une heures |
-    hour1(21) => vingt-deux heures |
-    hour1(22) => vingt-trois heures |
     hour1(23) => minuit |
+    hour1(h) => hour(h + 1) |
     min(0) => |
     min(1) => et une minute |
     min(15) => et quart |
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Code released in the Public Domain. You can do whatever you want with this package.
+# Look at README file to see how to adapt this program.
+#######################################
+# Tests of the errors raised by the rules
+#######################################
+# Run "$ python -m unittest test_timewriter.test_rules" from the activity
+# directory.
+
+import unittest
+
+import timewriter
+from test_timewriter.en_rules import _time_rules
+
+
+class MissingRuleTest(unittest.TestCase):
+    """A call that no rule matches raises the missing rule error, in all the
+    modes of the TimeWriter.
+    """
+
+    _MODES = [{}, {"compiled": False}, {"instrument": True}]
+
+
+    def _writers(self):
+        for mode in self._MODES:
+            writer = timewriter.TimeWriter(times_file="/nonexistent", **mode)
+            writer.set_rules(_time_rules)
+            yield mode, writer
+
+
+    def test_eval_rule(self):
+        for mode, writer in self._writers():
+            try:
+                writer.eval_rule("It is foo(1) now")
+            except Exception, e:
+                self.assertTrue(str(e).startswith("There is a missing rule"), (mode, e))
+                self.assertTrue("('foo', 1)" in str(e), (mode, e))
+            else:
+                self.fail("No error in mode %s" % mode)
+
+
+    def test_sub_call(self):
+        for mode, writer in self._writers():
+            writer.set_rules("time(h, m) => foo(h) |")
+            try:
+                writer.write_time(1, 2)
+            except Exception, e:
+                self.assertTrue(str(e).startswith("There is a missing rule"), (mode, e))
+            else:
+                self.fail("No error in mode %s" % mode)
+
+
+    def test_written_time(self):
+        for mode, writer in self._writers():
+            self.assertEqual(writer.eval_rule("It is time(15, 2)."),
+                             "It is two minutes past three PM.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,13 +8,14 @@
 
 """Inference engine to write times in English (or other language).
 
-Change the rules to adapt to another language. Caution: the rule parser does not
-strictly check the syntax and many errors will remained ignored.
+Change the rules to adapt to another language. Syntax errors in the rules are
+reported with the line and column where they are found.
 
 Usefull functions:
 - print_rules(): Dump the set of rules.
 - test_times(): Try to print all times from 00:00 to 23:59.
 - write_time(hour, minute): Write the (hour, minute) in natural language.
+- write_time_texts(hour, minute): Same, with and without the Pango markup.
 - eval_rule(text): Translate the text according to the set of rules.
 
 Example of usage:
@@ -34,10 +35,21 @@ http://en.wikipedia.org/wiki/12-hour_clock
 
 #import pdb
 
-import tokenize
-import cStringIO
-import re
-import copy
+import string
+import sys
+import os
+import time
+import hashlib
+import tempfile
+import cPickle
+import mmap
+import struct
+import itertools
+import operator
+import types
+import threading
+import gettext
+import logging
 
 from gettext import gettext as _
 
@@ -49,19 +61,233 @@ Pattern := Text? Pattern_call? Pattern?
 Pattern_call := Pattern_name ( Argument [, Argument]* )
 Text := string
 Pattern_name := string
-Argument := Dumb_variable_ | Variable | Value
+Argument := Dumb_variable_ | Variable | Value | Expression
 Dumb_variable := '_'
 Variable := string
 Value := number
+Expression := (Variable | Value) (Operator (Variable | Value))*
+Operator := '+' | '-' | '*' | '/' | '%'
 Rules := Rule ('|' Rules)*
 Rule := Pattern_call Range_condition* '=>' Text? Pattern_call? Pattern?
 Range_condition := '[' Argument '<' Argument ('<' Argument)? ']'
 
 '#' can be used to concatenate two Texts or Pattern_call without a space between.
+Expressions are only allowed in the calls of a rule body, with the variables of
+the rule pattern.
 """
 
+# Version of the rules cache files format. It must be changed each time the
+# representation of the parsed rules changes, so that old cache files are ignored.
+_CACHE_VERSION = 4
 
-class _Rule:
+# The message id of the time rules in the translation files
+_TIME_RULES_MSGID = "time(h, m) => What Time Is It?"
+
+# Default memory budget of the rule sets kept by a TimeWriterRegistry, in bytes
+_REGISTRY_BUDGET = 1024 * 1024
+
+# Maximum number of errors printed for each language when checking the translations
+_CHECK_PO_ERRORS = 10
+
+# The binary file of the times written by all the languages: the header (magic,
+# version, number of languages), the entry of each language (name, SHA-1 of the
+# rules source, offset of its index), and the indexes of offsets of the texts.
+_TIMES_MAGIC = "TWTF"
+_TIMES_VERSION = 1
+_TIMES_HEADER = struct.Struct("<4sII")
+_TIMES_ENTRY = struct.Struct("<16s20sI")
+_TIMES_OFFSET = struct.Struct("<I")
+_TIMES_TEXTS = struct.Struct("<III")
+
+# The name of the times file of a translation, in its locale directory next to
+# LC_MESSAGES
+_LOCALE_TIMES_FILE = "timewriter.times"
+
+
+# The arithmetic operators in the arguments of the rule calls. '/' is the integer
+# division.
+_OPERATORS = {"+": operator.add, "-": operator.sub, "*": operator.mul,
+              "/": operator.floordiv, "%": operator.mod}
+
+# The error message when no rule matches a pattern
+_MISSING_RULE = "There is a missing rule; match failed for pattern %s..."
+
+# The error message when an argument of a rule call divides by zero
+_DIVISION_BY_ZERO = "Division by zero in a rule argument: %s %s %s"
+
+# The named entities of the Pango markup
+_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"', "apos": "'"}
+
+
+def _missing_rule(pattern):
+    """Raise the error for a pattern that no rule can match.
+    """
+    raise Exception(_MISSING_RULE % [pattern])
+
+
+def _operate(op, left, right):
+    """Gets the value of an arithmetic operation in the arguments of the rule
+    calls. A division by zero raises the same error as a missing rule.
+    """
+    try:
+        return _OPERATORS[op](left, right)
+    except ZeroDivisionError:
+        raise Exception(_DIVISION_BY_ZERO % (left, op, right))
+
+
+def _compute(expression, bind):
+    """Gets the value of an arithmetic expression (operator, left, right), where
+    'left' and 'right' are numbers, variables bound in 'bind' or expressions.
+    """
+    op, left, right = expression
+    if isinstance(left, tuple):
+        left = _compute(left, bind)
+    else:
+        left = bind.get(left, left)
+    if isinstance(right, tuple):
+        right = _compute(right, bind)
+    else:
+        right = bind.get(right, right)
+    return _operate(op, left, right)
+
+
+def _strip_markup(text):
+    """Gets the plain text of a text with Pango markup, for instance to speak it.
+    The tags are removed, even when a quoted attribute value contains '>', and
+    the entities like '&amp;' are replaced by their character. An '&' which does
+    not start an entity is kept as is.
+    """
+    if "<" not in text and "&" not in text:
+        return text
+    result = []
+    pos = 0
+    length = len(text)
+    while pos < length:
+        c = text[pos]
+        if c == "<":
+            quote = None
+            pos += 1
+            while pos < length:
+                c = text[pos]
+                pos += 1
+                if quote is not None:
+                    if c == quote:
+                        quote = None
+                elif c == '"' or c == "'":
+                    quote = c
+                elif c == ">":
+                    break
+        elif c == "&":
+            end = text.find(";", pos)
+            char = None
+            if end > 0:
+                char = _entity(text[pos + 1:end], text)
+            if char is None:
+                result.append(c)
+                pos += 1
+            else:
+                result.append(char)
+                pos = end + 1
+        else:
+            end = pos + 1
+            while end < length and text[end] != "<" and text[end] != "&":
+                end += 1
+            result.append(text[pos:end])
+            pos = end
+    return "".join(result)
+
+
+def _entity(name, text):
+    """Gets the character of a markup entity, named or numeric like '#233' or
+    '#xE9', or None if it is not an entity. The character has the type of
+    'text', UTF-8 encoded for a str.
+    """
+    if name in _ENTITIES:
+        return _ENTITIES[name]
+    try:
+        if name[:2] in ("#x", "#X"):
+            char = unichr(int(name[2:], 16))
+        elif name[:1] == "#":
+            char = unichr(int(name[1:]))
+        else:
+            return None
+    except ValueError:
+        return None
+    if isinstance(text, str):
+        char = char.encode("utf-8")
+    return char
+
+
+def _rules_digest(source):
+    """Gets the SHA-1 digest of a rules source, identifying the times it writes.
+    """
+    if isinstance(source, unicode):
+        source = source.encode("utf-8")
+    return hashlib.sha1(source).digest()
+
+
+def _parse_translation_rules(source):
+    """Parse the rules of a translation, skipping the rules with a syntax error
+    with a warning, so that a broken rule does not prevent writing the others.
+    Returns the list of rules.
+    """
+    parser = _RuleParser(source)
+    rules = parser.parse_rules(strict=False)
+    for error in parser.errors:
+        logging.warning("Time rule skipped: %s", error)
+    return rules
+
+
+def _locale_times_file():
+    """Gets the path of the times file of the current translation, in the
+    directory of the gettext messages file of the current domain, or None when
+    the messages are not translated.
+    """
+    domain = gettext.textdomain()
+    path = gettext.find(domain, gettext.bindtextdomain(domain))
+    if path is None:
+        return None
+    # path is locale/<lang>/LC_MESSAGES/<domain>.mo
+    return os.path.join(os.path.dirname(os.path.dirname(path)), _LOCALE_TIMES_FILE)
+
+
+def _deep_size(obj, seen):
+    """Gets the memory size in bytes of an object and of the objects it contains:
+    tuples, lists, dictionaries, rules and the code of functions, with the
+    namespace of the compiled rules. The objects in the set of ids 'seen' are not
+    counted again.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        for item in obj:
+            size += _deep_size(item, seen)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, _Rule):
+        for name in obj.__slots__:
+            size += _deep_size(getattr(obj, name), seen)
+    elif isinstance(obj, types.FunctionType):
+        size += _deep_size(obj.func_code, seen) + _deep_size(obj.func_closure, seen)
+        namespace = obj.func_globals
+        # The globals of a module are not counted, only the namespace of the
+        # compiled rules, with their literal tables
+        if "__name__" not in namespace and id(namespace) not in seen:
+            seen.add(id(namespace))
+            size += sys.getsizeof(namespace)
+            for key, value in namespace.items():
+                if key != "__builtins__":
+                    size += _deep_size(key, seen) + _deep_size(value, seen)
+    elif isinstance(obj, types.CodeType):
+        size += _deep_size(obj.co_code, seen) + _deep_size(obj.co_consts, seen) + \
+            _deep_size(obj.co_names, seen)
+    return size
+
+
+class _Rule(object):
     """A rule is composed of conditions and a body.
         Rule: Conditions => Body
 
@@ -76,8 +302,13 @@ class _Rule:
     eventually firing the other rules called in the body definition.
     """
 
+    # Rules have no attribute dictionary, to save memory
+    __slots__ = ("_pattern", "_ranges", "_body")
+
+
     def __init__(self, pattern, ranges, body):
         """Create a new rule from its conditions, optional ranges and body.
+        All of them are tuples, so that the rule can't be changed once created.
         """
         self._pattern = pattern
         self._ranges = ranges
@@ -86,22 +317,24 @@ class _Rule:
 
     def get_pattern(self):
         """Gets the conditions pattern of the rule.
-        Returns a list [rule_name, arg1, arg2...].
+        Returns a tuple (rule_name, arg1, arg2...).
         """
         return self._pattern
 
 
     def get_ranges(self):
         """Gets the range condition to apply the rule.
-        Returns a list [[arg1, arg2], [arg1, arg2, arg3]...].
+        Returns a tuple ((arg1, arg2), (arg1, arg2, arg3)...), empty when the rule
+        has no range condition.
         """
         return self._ranges
 
 
     def get_body(self):
         """Gets the body of the rule.
-        Returns a list, for instance with two text fragments around another rule
-        call, [text1, [rule_name, arg1, arg2], text2].
+        Returns a tuple, for instance with two text fragments around another rule
+        call, (text1, (rule_name, arg1, arg2), text2). The arguments of the calls
+        can be arithmetic expressions (operator, left, right).
         """
         return self._body
 
@@ -122,7 +355,17 @@ class _Rule:
     def _repr_call(self, call):
         """Returns the external representation of a rule call.
         """
-        return "%s(%s)" % (call[0], ", ".join(str(x) for x in call[1:]))
+        return "%s(%s)" % (call[0], ", ".join(self._repr_arg(x) for x in call[1:]))
+
+
+    def _repr_arg(self, arg):
+        """Returns the external representation of a call argument.
+        The expressions are built by the parser following the precedence of the
+        operators, so they don't need parenthesis.
+        """
+        if isinstance(arg, tuple):
+            return "%s %s %s" % (self._repr_arg(arg[1]), arg[0], self._repr_arg(arg[2]))
+        return str(arg)
 
 
     def _repr_ranges(self, ranges):
@@ -133,7 +376,7 @@ class _Rule:
             if len(r) == 2:
                 result += " [ %s < %s ]" % (r[0], r[1])
             else:
-                result += " [ %s < %s < %s ]" % (r[0], r[1], r(2))
+                result += " [ %s < %s < %s ]" % (r[0], r[1], r[2])
         return result
 
 
@@ -142,23 +385,1450 @@ class _Rule:
         """
         result = ""
         for item in body:
-            if isinstance(item, list):
+            if isinstance(item, tuple):
                 result += "#" + self._repr_call(item)
             else:
                 result += item
         return result
 
 
+class _RuleParser:
+    """A single pass parser for the rules grammar.
+
+    The source is scanned once from start to end, building the rules as it goes.
+    Errors are raised as SyntaxError with the line and column where they are
+    found, so that translators know which rule to fix.
+    """
+
+    # Characters of rule names, variables and numbers
+    _NAME_CHARS = frozenset(string.ascii_letters + string.digits + "_")
+
+    # Spaces between the tokens of a rule
+    _SPACES = frozenset(" \t\r\n\f\v")
+
+    # Arithmetic operators in the arguments of the calls
+    _OPERATOR_CHARS = frozenset(_OPERATORS)
+
+
+    def __init__(self, source):
+        """Create a parser for the source of the rules or of a rule body.
+        """
+        self._source = source
+        # The unicode strings can't be interned; they are shared by the rules of
+        # the source only
+        self._strings = {}
+
+
+    def parse_rules(self, known=None, strict=True):
+        """Parse all the rules. Empty rules, like after a final '|', are ignored.
+            Rules := Rule ( '|' Rule )*
+        'known' maps the text of rules already parsed to their rule: a rule whose
+        text is found there is reused instead of being parsed again. The texts of
+        the rules of the source are kept in the 'texts' dictionary of the parser.
+        When 'strict' is False, the rules with a syntax error are skipped, and
+        their SyntaxError are kept in the 'errors' list of the parser.
+        Returns the list of rules.
+        """
+        rules = []
+        texts = {}
+        self.errors = []
+        pos = 0
+        length = len(self._source)
+        while pos <= length:
+            end = self._source.find("|", pos)
+            if end < 0:
+                end = length
+            pos = self._skip_spaces(pos, end)
+            if pos < end:
+                text = self._source[pos:end]
+                rule = None
+                if known is not None:
+                    rule = known.get(text)
+                if rule is None:
+                    try:
+                        rule = self._parse_rule(pos, end)
+                    except SyntaxError, e:
+                        if strict:
+                            raise
+                        self.errors.append(e)
+                if rule is not None:
+                    texts[text] = rule
+                    rules.append(rule)
+            pos = end + 1
+        self.texts = texts
+        return rules
+
+
+    def parse_body(self):
+        """Parse the whole source as a rule body, without variables.
+        Returns a tuple (text, (pattern, arg1, arg2...), text, ...)
+        """
+        return self._parse_body(0, len(self._source), frozenset())
+
+
+    def _parse_rule(self, pos, end):
+        """Parse a single rule, from 'pos' to the '|' at 'end'.
+        A rule is composed of a pattern and a body, separated by =>. The body ends
+        with the line.
+            Rule := Pattern_call Range_condition* '=>' Rule_body
+        Return a rule definition object.
+        """
+        source = self._source
+        spaces = self._SPACES
+        pattern, pos = self._parse_call(pos, end, None)
+        while pos < end and source[pos] in spaces:
+            pos += 1
+        if pos < end and source[pos] == "[":
+            ranges, pos = self._parse_ranges(pos, end)
+        else:
+            ranges = ()
+        if pos >= end or not source.startswith("=>", pos):
+            self._error("'=>' expected", pos)
+        pos += 2
+
+        body_end = source.find("\n", pos, end)
+        if body_end < 0:
+            body_end = end
+        elif source[body_end:end].strip():
+            self._error("'|' expected at the end of the rule", self._skip_spaces(body_end, end))
+
+        # Spaces around the body are not significant
+        text = source[pos:body_end]
+        stripped = text.lstrip()
+        pos += len(text) - len(stripped)
+        body_end = pos + len(stripped.rstrip())
+        variables = frozenset([arg for arg in pattern[1:] if isinstance(arg, str) and arg != "_"])
+        return _Rule(pattern, ranges, self._parse_body(pos, body_end, variables))
+
+
+    def _parse_call(self, pos, end, variables):
+        """Parse a rule pattern or call at 'pos'.
+        A rule call is similar to a function call.
+            Rule_call := Rule_name '(' ( arg [',' arg]* ) ')'
+        'variables' is the set of variables of the rule pattern for a call in a
+        rule body, or None for the rule pattern.
+        Returns a tuple (Rule_name, arg1, arg2...) and the position after the call.
+        """
+        source = self._source
+        name_chars = self._NAME_CHARS
+        name_end = pos
+        while name_end < end and source[name_end] in name_chars:
+            name_end += 1
+        if name_end == pos:
+            self._error("rule name expected", pos)
+        paren = name_end
+        while paren < end and source[paren] in self._SPACES:
+            paren += 1
+        if paren >= end or source[paren] != "(":
+            self._error("'(' expected", paren)
+        close = self._find_close(paren, end)
+        if close < 0:
+            self._error("')' expected", paren)
+        call = (self._intern(source[pos:name_end]),) + self._parse_args(paren + 1, close, variables)
+        return call, close + 1
+
+
+    def _find_close(self, paren, end):
+        """Gets the position of the ')' closing the call arguments started at
+        'paren', on the same line, or -1.
+        """
+        close = self._source.find(")", paren, end)
+        if close >= 0 and self._source.find("\n", paren, close) >= 0:
+            return -1
+        return close
+
+
+    def _parse_args(self, pos, end, variables):
+        """Parse the arguments of a call, up to the closing parenthesis at 'end'.
+        Arguments are numbers or variable names, separated by commas. In the
+        calls of a rule body, they can also be arithmetic expressions of numbers
+        and of the variables of the rule pattern, 'variables'.
+            arg := value (operator value)*
+            operator := '+' | '-' | '*' | '/' | '%'
+        Returns the tuple of the arguments.
+        """
+        source = self._source
+        name_chars = self._NAME_CHARS
+        operators = self._OPERATOR_CHARS
+        args = []
+        # Values and operators of the current argument
+        items = []
+        start = pos
+        while pos < end:
+            c = source[pos]
+            if c in operators:
+                if len(items) % 2 == 0:
+                    self._error("value expected before '%s'" % c, pos)
+                items.append(c)
+                pos += 1
+                continue
+            if c == ",":
+                if items:
+                    args.append(self._parse_expression(items, start, pos, variables))
+                    items = []
+                pos += 1
+                continue
+            if c in self._SPACES:
+                pos += 1
+                continue
+            if items and len(items) % 2 == 1:
+                # Two values without an operator are two arguments
+                args.append(self._parse_expression(items, start, pos, variables))
+                items = []
+            if not items:
+                start = pos
+            if c in name_chars:
+                token_start = pos
+                while pos < end and source[pos] in name_chars:
+                    pos += 1
+                token = source[token_start:pos]
+                if token.isdigit():
+                    token = int(token)
+                else:
+                    token = self._intern(token)
+                items.append(token)
+            else:
+                # Any other character is kept as a one character variable
+                items.append(self._intern(c))
+                pos += 1
+        if items:
+            args.append(self._parse_expression(items, start, pos, variables))
+        return tuple(args)
+
+
+    def _parse_expression(self, items, pos, end, variables):
+        """Build an argument from the list of its values and operators, found
+        from 'pos' to 'end'.
+        '*', '/' and '%' are applied before '+' and '-', from left to right.
+        The operations on numbers are computed by the parser.
+        Returns a number, a variable or an expression (operator, left, right).
+        """
+        if len(items) == 1:
+            return items[0]
+        if len(items) % 2 == 0:
+            self._error("value expected after '%s'" % items[-1], end)
+        for value in items[::2]:
+            if isinstance(value, str) and (variables is None or value not in variables):
+                if variables is None:
+                    self._error("expressions are not allowed in a rule pattern", pos)
+                self._error("variable '%s' is not bound by the rule pattern" % value, pos)
+        for group in ("*/%", "+-"):
+            result = [items[0]]
+            for i in range(1, len(items), 2):
+                op, right = items[i], items[i + 1]
+                if op not in group:
+                    result.extend([op, right])
+                elif isinstance(result[-1], int) and isinstance(right, int):
+                    try:
+                        result[-1] = _OPERATORS[op](result[-1], right)
+                    except ZeroDivisionError:
+                        self._error("division by zero", pos)
+                else:
+                    result[-1] = (op, result[-1], right)
+            items = result
+        return items[0]
+
+
+    def _parse_ranges(self, pos, end):
+        """Parse zero or many range conditions.
+            Range_conditions := Range_condition*
+            Range_condition := '[' arg1 '<' arg2 ('<' arg3)? ']'
+        Returns a tuple ((arg11, arg12), (arg21, arg22, arg23)...) and the position
+        after the ranges.
+        """
+        ranges = []
+        while pos < end and self._source[pos] == "[":
+            close = self._source.find("]", pos, end)
+            if close < 0:
+                self._error("']' expected", pos)
+            args = self._source[pos + 1:close].split("<")
+            if len(args) not in (2, 3):
+                self._error("range condition must be [a < b] or [a < b < c]", pos)
+            values = []
+            for arg in args:
+                arg = arg.strip()
+                if arg == "":
+                    self._error("range condition value expected", pos)
+                values.append(self._value(arg))
+            ranges.append(tuple(values))
+            pos = self._skip_spaces(close + 1, end)
+        return tuple(ranges), pos
+
+
+    def _parse_body(self, pos, end, variables):
+        """Parse the right hand side of a rule, from 'pos' to 'end', where the
+        rule pattern binds 'variables'.
+        Spaces are preserved in the text fragments.
+            Rule_body := text? Pattern_call? Rule_body?
+        Returns a tuple (text, (pattern, arg1, arg2...), text, ...)
+        '#' is a concatenation operator if not escaped by '\'
+        """
+        body = []
+        text = []
+        escaped = False
+        search = pos
+        while True:
+            paren = self._source.find("(", search, end)
+            if paren < 0:
+                break
+            search = paren + 1
+            # A call is a name, maybe followed by spaces, and the parenthesis
+            name_end = paren
+            while name_end > pos and self._source[name_end - 1] in self._SPACES:
+                name_end -= 1
+            name_start = name_end
+            while name_start > pos and self._source[name_start - 1] in self._NAME_CHARS:
+                name_start -= 1
+            if name_start == name_end or self._find_close(paren, end) < 0:
+                continue
+            escaped = self._add_text(text, pos, name_start, escaped)
+            if text:
+                body.append(self._intern("".join(text)))
+                text = []
+            call, pos = self._parse_call(name_start, end, variables)
+            body.append(call)
+            search = pos
+        self._add_text(text, pos, end, escaped)
+        if text:
+            body.append(self._intern("".join(text)))
+        return tuple(body)
+
+
+    def _add_text(self, text, pos, end, escaped):
+        """Add the text fragment from 'pos' to 'end' to the list 'text', removing
+        the '#' concatenation operators, the escaping '\' and the new lines.
+        Returns the escaping state at the end of the fragment.
+        """
+        fragment = self._source[pos:end]
+        if "\\" not in fragment and "#" not in fragment and "\n" not in fragment:
+            if fragment:
+                text.append(fragment)
+                escaped = False
+            return escaped
+        for c in fragment:
+            if c == "\\":
+                escaped = True
+            elif c == "#":
+                if escaped:
+                    text.append(c)
+                    escaped = False
+            elif c != "\n":
+                text.append(c)
+                escaped = False
+        return escaped
+
+
+    def _skip_spaces(self, pos, end):
+        """Gets the position of the first non space character from 'pos'.
+        """
+        while pos < end and self._source[pos] in self._SPACES:
+            pos += 1
+        return pos
+
+
+    def _value(self, token):
+        """Gets the value of an argument: a number or a variable name.
+        """
+        try:
+            return int(token)
+        except ValueError:
+            return self._intern(token)
+
+
+    def _intern(self, text):
+        """Gets the shared copy of a name or text fragment, so that the strings
+        repeated in the rules, like the rule names, are stored once.
+        """
+        if isinstance(text, str):
+            return intern(text)
+        return self._strings.setdefault(text, text)
+
+
+    def _error(self, message, pos):
+        """Raise a SyntaxError for the character at 'pos'.
+        """
+        line_start = self._source.rfind("\n", 0, pos) + 1
+        line_end = self._source.find("\n", pos)
+        if line_end < 0:
+            line_end = len(self._source)
+        line = self._source.count("\n", 0, pos) + 1
+        column = pos - line_start + 1
+        raise SyntaxError("Syntax error in rules, line %d column %d: %s" % (line, column, message),
+                          ("<rules>", line, column, self._source[line_start:line_end]))
+
+
+class _LRUCache:
+    """A dictionary of bounded size, forgetting the least recently used entries.
+    Counts the number of hits and misses of the lookups.
+
+    Each entry is stamped with a counter when it is used. When the cache is full,
+    the oldest quarter of the entries is forgotten at once, so that a lookup only
+    costs a dictionary access.
+
+    The cache can be used by many threads. Only the changes of the dictionary
+    take a lock: a lookup never waits. The counters are not locked, and can miss
+    some concurrent lookups.
+    """
+
+    def __init__(self, size):
+        """Create an empty cache keeping at most 'size' entries.
+        """
+        self._size = size
+        self._items = {}
+        self._clock = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+        """Gets the value stored for the key, or None.
+        The entry becomes the most recently used.
+        """
+        entry = self._items.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        entry[1] = next(self._clock)
+        self.hits += 1
+        return entry[0]
+
+
+    def put(self, key, value):
+        """Store a value for the key, forgetting the least recently used entries
+        when the cache is full.
+        """
+        self._lock.acquire()
+        try:
+            if len(self._items) >= self._size and key not in self._items:
+                stamps = sorted(entry[1] for entry in self._items.itervalues())
+                oldest = stamps[len(stamps) // 4]
+                for k, entry in self._items.items():
+                    if entry[1] <= oldest:
+                        del self._items[k]
+            self._items[key] = [value, next(self._clock)]
+        finally:
+            self._lock.release()
+
+
+    def clear(self):
+        """Forget all the entries and reset the counters.
+        """
+        self._lock.acquire()
+        try:
+            self._items.clear()
+        finally:
+            self._lock.release()
+        self.hits = 0
+        self.misses = 0
+
+
+    def copy(self, size, keep):
+        """Gets a new cache of 'size' entries, with the entries of this cache
+        whose key is accepted by the function 'keep'. The counters start at 0.
+        """
+        cache = _LRUCache(size)
+        for key, entry in self._items.items():
+            if keep(key):
+                cache._items[key] = [entry[0], next(cache._clock)]
+        return cache
+
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _RuleCompiler:
+    """Translate a set of rules into Python functions.
+
+    All the rules with the same name and arity become a single function, taking
+    the call arguments as parameters. The rules are tested in order by if
+    statements, range conditions being inline comparisons. A run of rules with
+    only numbers as arguments and only text in their body is looked up in a
+    dictionary. Calls in the rule bodies are direct calls to the other functions.
+
+    The names of the functions only depend on the name and arity of their rules,
+    so that the source of a function only changes when its rules change.
+
+    Example: the rules
+        am_pm(h) [h < 12] => AM |
+        am_pm(_) => PM
+    are compiled as:
+        def _r_am_pm_2(a1):
+            if a1 < 12:
+                return 'AM'
+            return 'PM'
+            return _missing(('am_pm', a1,))
+    """
+
+    def __init__(self, rules):
+        """Group the rules by name and arity, keeping their order.
+        """
+        self._keys = []
+        self._groups = {}
+        self._names = {}
+        for rule in rules:
+            cond = rule.get_pattern()
+            key = (cond[0], len(cond))
+            if key not in self._groups:
+                self._keys.append(key)
+                self._groups[key] = []
+                self._names[key] = "_r_%s_%d" % (str(key[0]), key[1])
+            self._groups[key].append(rule)
+
+
+    def compile(self, interpret, codes=None):
+        """Compile all the groups of rules.
+        'interpret' is the function called with a pattern (rule_name, arg1...)
+        for the groups of rules that can't be compiled.
+        'codes' maps the Python source of groups already compiled to their code,
+        which is reused when the source of a group did not change. The codes of
+        all the groups are kept in the 'codes' dictionary of the compiler.
+        Returns a dictionary {(rule_name, arity): function} for the compiled groups.
+        """
+        namespace = {"_missing": _missing_rule, "_operate": _operate}
+        functions = {}
+        self.codes = {}
+        for key in self._keys:
+            source = self._compile_group(key, namespace)
+            if codes is not None and source in codes:
+                code = codes[source]
+            else:
+                try:
+                    code = compile(source, "<rules %s>" % key[0], "exec")
+                except SyntaxError:
+                    code = None
+            self.codes[source] = code
+            if code is None:
+                # The compiled functions still call this group by its name
+                namespace[self._names[key]] = self._fallback(key[0], interpret)
+            else:
+                exec code in namespace
+                functions[key] = namespace[self._names[key]]
+        return functions
+
+
+    def _fallback(self, rule_name, interpret):
+        """Gets a function evaluating a group of rules with the interpreter.
+        """
+        def function(*args):
+            return interpret((rule_name,) + args)
+        return function
+
+
+    def _compile_group(self, key, namespace):
+        """Gets the Python source of the function for a group of rules.
+        The dictionaries of literal rules are added to the namespace.
+        """
+        params = ["a%d" % i for i in range(1, key[1])]
+        name = self._names[key]
+        lines = ["def %s(%s):" % (name, ", ".join(params))]
+        literals = {}
+        for rule in self._groups[key]:
+            if self._is_literal(rule):
+                args = rule.get_pattern()[1:]
+                if len(args) == 1:
+                    args = args[0]
+                # The first rule defined for a value wins
+                if args not in literals:
+                    literals[args] = "".join(rule.get_body())
+                continue
+            self._compile_literals(name, literals, params, lines, namespace)
+            literals = {}
+            self._compile_rule(rule, params, lines)
+        self._compile_literals(name, literals, params, lines, namespace)
+        lines.append("    return _missing((%s,))" % ", ".join([repr(key[0])] + params))
+        return "\n".join(lines) + "\n"
+
+
+    def _is_literal(self, rule):
+        """Tells if the rule has only numbers as arguments, no range condition and
+        only text in its body, so that it can be put in a dictionary.
+        """
+        cond = rule.get_pattern()
+        if len(cond) == 1 or rule.get_ranges():
+            return False
+        for arg in cond[1:]:
+            if not isinstance(arg, int):
+                return False
+        for item in rule.get_body():
+            if isinstance(item, tuple):
+                return False
+        return True
+
+
+    def _compile_literals(self, function, literals, params, lines, namespace):
+        """Add the lookup of a run of literal rules to the function.
+        """
+        if not literals:
+            return
+        # Numbered from the start of the function
+        name = "_d%s_%d" % (function[2:], len(lines))
+        namespace[name] = literals
+        if len(params) == 1:
+            lines.append("    v = %s.get(%s)" % (name, params[0]))
+        else:
+            lines.append("    v = %s.get((%s))" % (name, ", ".join(params)))
+        lines.append("    if v is not None:")
+        lines.append("        return v")
+
+
+    def _compile_rule(self, rule, params, lines):
+        """Add the test and body of a rule to the function.
+        """
+        # The variables are bound to the parameters of the function
+        bind = {}
+        conditions = []
+        for param, arg in zip(params, rule.get_pattern()[1:]):
+            if arg == "_":
+                continue
+            if isinstance(arg, int):
+                conditions.append("%s == %d" % (param, arg))
+            elif arg not in bind:
+                bind[arg] = param
+
+        for r in rule.get_ranges():
+            values = []
+            for arg in r:
+                if isinstance(arg, int):
+                    values.append("%d" % arg)
+                elif arg in bind:
+                    values.append(bind[arg])
+                else:
+                    # An unbound variable never matches: drop the rule
+                    return
+            conditions.append(" < ".join(values))
+
+        body = []
+        for item in rule.get_body():
+            if isinstance(item, tuple):
+                body.append(self._compile_call(item, bind))
+            else:
+                body.append(repr(item))
+        if not body:
+            body.append("''")
+
+        if conditions:
+            lines.append("    if %s:" % " and ".join(conditions))
+            lines.append("        return %s" % " + ".join(body))
+        else:
+            lines.append("    return %s" % " + ".join(body))
+
+
+    def _compile_call(self, call, bind):
+        """Gets the Python expression of a rule call in a body.
+        """
+        args = [self._compile_arg(arg, bind) for arg in call[1:]]
+        key = (call[0], len(call))
+        if key not in self._names:
+            return "_missing((%s,))" % ", ".join([repr(call[0])] + args)
+        return "%s(%s)" % (self._names[key], ", ".join(args))
+
+
+    def _compile_arg(self, arg, bind):
+        """Gets the Python expression of an argument of a rule call.
+        """
+        if isinstance(arg, int):
+            return "%d" % arg
+        if isinstance(arg, tuple):
+            op = arg[0]
+            if op in "/%":
+                # The divisions raise the rule error when dividing by zero
+                return "_operate(%r, %s, %s)" % (op, self._compile_arg(arg[1], bind), self._compile_arg(arg[2], bind))
+            return "(%s %s %s)" % (self._compile_arg(arg[1], bind), op, self._compile_arg(arg[2], bind))
+        if arg in bind:
+            return bind[arg]
+        # Unbound variables are passed as is, like the interpreter does
+        return repr(arg)
+
+
+class _RuleOptimizer:
+    """Analyze a list of rules to remove the rules which can never fire, and to
+    reorder the rules which never match the same pattern, so that the most used
+    ones are tried first.
+    The conditions of a rule are summarized by an interval of values for each
+    argument: a number gives [n, n], a variable gives any value, narrowed by the
+    range conditions comparing it with numbers. A range comparing two variables
+    can't be summarized; it is ignored, which gives more values than the rule
+    really matches.
+    Rules with a different name or arity never compete and are analyzed apart.
+    """
+
+
+    def __init__(self, rules):
+        """Prepare the analysis of the list of rules.
+        """
+        self._rules = rules
+
+
+    def optimize(self, frequencies=None):
+        """Optimize the rules.
+        'frequencies' maps the id() of a rule to the number of times it fired,
+        as given by TimeWriter.rule_stats(). Without it, the rules matching the
+        largest number of values are expected to fire more often.
+        Returns the list of optimized rules and a report, a dictionary with:
+        - "unsatisfiable": the list of rules whose conditions are never true;
+        - "shadowed": a list of (rule, earlier_rule), for the rules matching only
+          patterns already matched by an earlier rule;
+        - "reordered": the list of the groups of rules whose order changed,
+          each group in its new order.
+        Shadowed and unsatisfiable rules are removed. For any pattern, the rule
+        fired by the optimized rules is the one fired by the original rules.
+        """
+        report = {"unsatisfiable": [], "shadowed": [], "reordered": []}
+        groups = {}
+        keys = []
+        for rule in self._rules:
+            cond = rule.get_pattern()
+            key = (cond[0], len(cond))
+            if key not in groups:
+                groups[key] = []
+                keys.append(key)
+            groups[key].append(rule)
+
+        optimized = []
+        for key in keys:
+            kept = self._remove_dead(groups[key], report)
+            for run in self._disjoint_runs(kept):
+                ordered = sorted(run, key=lambda (rule, intervals):
+                                 -self._frequency(rule, intervals, frequencies))
+                if ordered != run:
+                    report["reordered"].append([rule for rule, intervals in ordered])
+                optimized.extend([rule for rule, intervals in ordered])
+        return optimized, report
+
+
+    def _remove_dead(self, rules, report):
+        """Remove the unsatisfiable and shadowed rules of a group.
+        Returns the list of (rule, intervals) of the rules kept.
+        """
+        kept = []
+        for rule in rules:
+            intervals, exact = self._intervals(rule)
+            if intervals is None:
+                report["unsatisfiable"].append(rule)
+                continue
+            for earlier, earlier_intervals, earlier_exact in kept:
+                if earlier_exact and self._contains(earlier_intervals, intervals):
+                    report["shadowed"].append((rule, earlier))
+                    break
+            else:
+                kept.append((rule, intervals, exact))
+        return [(rule, intervals) for rule, intervals, exact in kept]
+
+
+    def _disjoint_runs(self, rules):
+        """Split the (rule, intervals) list in runs of consecutive rules which
+        never match the same pattern, so that they can be tried in any order.
+        Returns the list of runs.
+        """
+        runs = []
+        run = []
+        for rule, intervals in rules:
+            for other, other_intervals in run:
+                if not self._disjoint(intervals, other_intervals):
+                    runs.append(run)
+                    run = []
+                    break
+            run.append((rule, intervals))
+        if run:
+            runs.append(run)
+        return runs
+
+
+    def _intervals(self, rule):
+        """Gets the interval [low, high] of the values matched by each argument
+        of the rule, None meaning no limit.
+        Returns (intervals, exact) where 'exact' is False when a range condition
+        was ignored, or (None, False) if the rule can never match.
+        """
+        cond = rule.get_pattern()
+        intervals = [[None, None] for arg in cond[1:]]
+        # The first binding of a variable wins
+        position = {}
+        for i, arg in enumerate(cond[1:]):
+            if isinstance(arg, int):
+                intervals[i] = [arg, arg]
+            elif arg != "_" and arg not in position:
+                position[arg] = i
+
+        exact = True
+        for r in rule.get_ranges():
+            for arg in r:
+                if not isinstance(arg, int) and arg not in position:
+                    # An unbound variable never matches
+                    return None, False
+            for low, high in zip(r[:-1], r[1:]):
+                if isinstance(low, int) and isinstance(high, int):
+                    if low >= high:
+                        return None, False
+                elif isinstance(high, int):
+                    interval = intervals[position[low]]
+                    interval[1] = self._min(interval[1], high - 1)
+                elif isinstance(low, int):
+                    interval = intervals[position[high]]
+                    interval[0] = self._max(interval[0], low + 1)
+                else:
+                    exact = False
+
+        for low, high in intervals:
+            if low is not None and high is not None and low > high:
+                return None, False
+        return intervals, exact
+
+
+    def _min(self, a, b):
+        if a is None:
+            return b
+        return min(a, b)
+
+
+    def _max(self, a, b):
+        if a is None:
+            return b
+        return max(a, b)
+
+
+    def _contains(self, outer, inner):
+        """Tells if all the values of the intervals 'inner' are in 'outer'.
+        """
+        for (low, high), (inner_low, inner_high) in zip(outer, inner):
+            if low is not None and (inner_low is None or inner_low < low):
+                return False
+            if high is not None and (inner_high is None or inner_high > high):
+                return False
+        return True
+
+
+    def _disjoint(self, a, b):
+        """Tells if no pattern can be in both intervals 'a' and 'b'.
+        """
+        for (low, high), (other_low, other_high) in zip(a, b):
+            if high is not None and other_low is not None and high < other_low:
+                return True
+            if other_high is not None and low is not None and other_high < low:
+                return True
+        return False
+
+
+    def _frequency(self, rule, intervals, frequencies):
+        """Gets the observed or expected frequency of a rule.
+        """
+        if frequencies is not None:
+            return frequencies.get(id(rule), 0)
+        size = 1
+        for low, high in intervals:
+            if low is None or high is None:
+                return float("inf")
+            size *= high - low + 1
+        return size
+
+
+class _CoverageChecker:
+    """Prove that the rules write all the times of the day, without writing them.
+    The calls are evaluated symbolically: the arguments of a call are numbers, or
+    the variables of the root call time(h, m), and the values of h and m are
+    sets of intervals, a box. Trying a rule splits the box in the part matching
+    its conditions, which is evaluated in its body, and the part left for the
+    next rules. The part left by the last rule has no rule to match.
+    The range conditions comparing h and m together, and the conditions on the
+    arithmetic expressions of h and m, are checked for each value.
+    """
+
+    # The variables of the root call
+    _HOUR = ("v", 0)
+    _MINUTE = ("v", 1)
+
+
+    def __init__(self, rules, bind):
+        """Prepare the check of the rules. 'bind' is the method matching a call
+        to a rule of the TimeWriter.
+        """
+        self._bind = bind
+        self._groups = {}
+        for rule in rules:
+            cond = rule.get_pattern()
+            self._groups.setdefault((cond[0], len(cond)), []).append(rule)
+        self._memo = {}
+        self._stack = set()
+        self.fired = set()
+
+
+    def check(self):
+        """Check the rules for all the times from 00:00 to 23:59.
+        Returns the list of (hour, minute, message) for each time that can't be
+        written, in order, with the message of the error raised by write_time().
+        The id() of the rules fired for some times are added to 'fired'.
+        """
+        gaps = self._check(("time", self._HOUR, self._MINUTE), ((0, 23), (0, 59)))
+        errors = {}
+        for call, box, recursive in gaps:
+            for hour in range(box[0][0], box[0][1] + 1):
+                for minute in range(box[1][0], box[1][1] + 1):
+                    # Only the first error of a time is raised
+                    if (hour, minute) in errors:
+                        continue
+                    try:
+                        pattern = self._instantiate(call, (hour, minute))
+                    except Exception, e:
+                        # The arguments of the call divide by zero for this time
+                        errors[(hour, minute)] = str(e)
+                        continue
+                    if recursive:
+                        message = "Recursive rule call %s" % (pattern,)
+                    else:
+                        message = _MISSING_RULE % [pattern]
+                    errors[(hour, minute)] = message
+        return [(hour, minute, message) for (hour, minute), message in sorted(errors.items())]
+
+
+    def _check(self, call, box):
+        """Evaluate a call for all the values of the variables in 'box'.
+        Returns the list of (call, box, recursive) of the failed calls, in the
+        order of evaluation. The boxes of the failures only give the intervals of
+        the variables used by the call, the others being None: the caller fills
+        them with its own intervals.
+        """
+        used = set()
+        for arg in call[1:]:
+            self._variables(arg, used)
+        box = tuple([(interval if i in used else None) for i, interval in enumerate(box)])
+        key = (call, box)
+        if key in self._memo:
+            return self._memo[key]
+        if key in self._stack:
+            return [(call, box, True)]
+        self._stack.add(key)
+
+        gaps = []
+        remaining = [box]
+        if [arg for arg in call[1:] if self._divides(arg)]:
+            # The values dividing by zero fail before any rule is tried
+            points = []
+            for point in self._points(box):
+                try:
+                    self._instantiate(call, [interval and interval[0] for interval in point])
+                    points.append(point)
+                except Exception:
+                    gaps.append((call, point, False))
+            if gaps:
+                remaining = points
+        for rule in self._groups.get((call[0], len(call)), []):
+            if not remaining:
+                break
+            bind, constraints, exact = self._conditions(rule, call[1:])
+            if bind is None:
+                continue
+            matched = []
+            left = []
+            for part in remaining:
+                inside, outside = self._split(part, constraints)
+                left.extend(outside)
+                if inside is None:
+                    continue
+                if exact:
+                    matched.append(inside)
+                    continue
+                # Check each value, for the ranges comparing two variables
+                for point in self._points(inside):
+                    values = [interval and interval[0] for interval in point]
+                    if self._bind(rule, self._instantiate(call, values)) is not None:
+                        matched.append(point)
+                    else:
+                        left.append(point)
+            remaining = left
+            if matched:
+                self.fired.add(id(rule))
+            for part in matched:
+                for item in rule.get_body():
+                    if isinstance(item, tuple):
+                        sub_call = (item[0],) + tuple([self._substitute(arg, bind) for arg in item[1:]])
+                        for gap_call, gap_box, recursive in self._check(sub_call, part):
+                            gap_box = tuple([(gap or interval) for gap, interval in zip(gap_box, part)])
+                            gaps.append((gap_call, gap_box, recursive))
+        for part in remaining:
+            gaps.append((call, part, False))
+
+        self._stack.remove(key)
+        self._memo[key] = gaps
+        return gaps
+
+
+    def _conditions(self, rule, args):
+        """Gets the conditions for the arguments of a call to match a rule.
+        Returns (bind, constraints, exact) where 'bind' maps the variables of the
+        rule to the arguments, 'constraints' maps the variables of the root call
+        to the interval [low, high] of their values matching the rule, None meaning
+        no limit, and 'exact' is False when the constraints are not enough: the
+        ranges compare two variables or the arguments are expressions.
+        Returns (None, None, None) if the rule can't match.
+        """
+        cond = rule.get_pattern()
+        bind = {}
+        constraints = {}
+        exact = True
+        for value, arg in zip(cond[1:], args):
+            if value == "_":
+                continue
+            if isinstance(value, int):
+                if self._is_variable(arg):
+                    if not self._constrain(constraints, arg[1], value, value):
+                        return None, None, None
+                elif isinstance(arg, tuple):
+                    exact = False
+                elif arg != value:
+                    return None, None, None
+            elif value not in bind:
+                bind[value] = arg
+
+        for r in rule.get_ranges():
+            values = []
+            for value in r:
+                if isinstance(value, int):
+                    values.append(value)
+                elif value in bind:
+                    values.append(bind[value])
+                else:
+                    # An unbound variable never matches
+                    return None, None, None
+            for low, high in zip(values[:-1], values[1:]):
+                if not isinstance(low, tuple) and not isinstance(high, tuple):
+                    if low >= high:
+                        return None, None, None
+                elif low == high:
+                    return None, None, None
+                elif self._is_variable(low) and isinstance(high, int):
+                    if not self._constrain(constraints, low[1], None, high - 1):
+                        return None, None, None
+                elif self._is_variable(high) and isinstance(low, int):
+                    if not self._constrain(constraints, high[1], low + 1, None):
+                        return None, None, None
+                else:
+                    exact = False
+        return bind, constraints, exact
+
+
+    def _is_variable(self, arg):
+        """Tells if a call argument is a variable of the root call.
+        """
+        return isinstance(arg, tuple) and arg[0] == "v"
+
+
+    def _divides(self, arg):
+        """Tells if an argument of a call has a division, which can fail.
+        """
+        if not isinstance(arg, tuple) or self._is_variable(arg):
+            return False
+        return arg[0] in "/%" or self._divides(arg[1]) or self._divides(arg[2])
+
+
+    def _variables(self, arg, variables):
+        """Add the variables of the root call used by an argument to the set.
+        """
+        if self._is_variable(arg):
+            variables.add(arg[1])
+        elif isinstance(arg, tuple):
+            self._variables(arg[1], variables)
+            self._variables(arg[2], variables)
+
+
+    def _substitute(self, arg, bind):
+        """Gets the argument of a call in a rule body, with the variables of the
+        rule replaced by their values: numbers, variables of the root call or
+        expressions of them. The expressions of numbers are computed.
+        """
+        if not isinstance(arg, tuple):
+            return bind.get(arg, arg)
+        left = self._substitute(arg[1], bind)
+        right = self._substitute(arg[2], bind)
+        if isinstance(left, int) and isinstance(right, int) and (right != 0 or arg[0] not in "/%"):
+            return _OPERATORS[arg[0]](left, right)
+        # A division by zero is kept, to fail when the call is checked
+        return (arg[0], left, right)
+
+
+    def _value(self, arg, values):
+        """Gets the value of an argument for the values of the root variables.
+        """
+        if self._is_variable(arg):
+            return values[arg[1]]
+        if isinstance(arg, tuple):
+            return _operate(arg[0], self._value(arg[1], values), self._value(arg[2], values))
+        return arg
+
+
+    def _constrain(self, constraints, variable, low, high):
+        """Narrow the interval of a variable in the constraints.
+        Returns False if the interval becomes empty.
+        """
+        old_low, old_high = constraints.get(variable, (None, None))
+        if low is None or (old_low is not None and old_low > low):
+            low = old_low
+        if high is None or (old_high is not None and old_high < high):
+            high = old_high
+        constraints[variable] = (low, high)
+        return low is None or high is None or low <= high
+
+
+    def _split(self, box, constraints):
+        """Split a box in the part inside the constraints and the parts outside.
+        Returns (inside, outside), 'inside' being None if it is empty.
+        """
+        outside = []
+        for variable, (low, high) in sorted(constraints.items()):
+            box_low, box_high = box[variable]
+            if low is None or low < box_low:
+                low = box_low
+            if high is None or high > box_high:
+                high = box_high
+            if low > high:
+                return None, outside + [box]
+            if box_low < low:
+                outside.append(self._replace(box, variable, (box_low, low - 1)))
+            if high < box_high:
+                outside.append(self._replace(box, variable, (high + 1, box_high)))
+            box = self._replace(box, variable, (low, high))
+        return box, outside
+
+
+    def _replace(self, box, variable, interval):
+        """Gets a copy of the box with a new interval for a variable.
+        """
+        box = list(box)
+        box[variable] = interval
+        return tuple(box)
+
+
+    def _points(self, box):
+        """Gets the boxes of each value of the box.
+        """
+        points = [()]
+        for interval in box:
+            if interval is None:
+                points = [point + (None,) for point in points]
+            else:
+                points = [point + ((value, value),) for point in points
+                          for value in range(interval[0], interval[1] + 1)]
+        return points
+
+
+    def _instantiate(self, call, values):
+        """Gets the call with the variables replaced by their values.
+        """
+        return (call[0],) + tuple([self._value(arg, values) for arg in call[1:]])
+
+
+class _RuleSet(object):
+    """A set of parsed rules, with their dispatch index and their compiled
+    functions. A rule set is never changed once built, so the TimeWriters and
+    their threads can share it.
+    """
+
+
+    def __init__(self, rules, compiled=True, previous=None):
+        """Build the rule set of a list of parsed rules.
+        When 'compiled' is True, the rules are translated to Python functions.
+        'previous' is a rule set built before from mostly the same rules: the
+        index entries and the compiled code of its unchanged groups of rules are
+        reused.
+        """
+        self.rules = rules
+        self.compiled = compiled
+        self.groups = self._group_rules(rules)
+        self.index = self._index_rules(previous)
+        self.codes = None
+        if compiled:
+            compiler = _RuleCompiler(rules)
+            codes = None
+            if previous is not None:
+                codes = previous.codes
+            self.functions = compiler.compile(self._interpret_call, codes)
+            self.codes = compiler.codes
+        else:
+            self.functions = {}
+        self._interpreter = None
+
+
+    def _group_rules(self, rules):
+        """Group the rules by (rule_name, arity), where the arity is the length
+        of the pattern list.
+        Returns a dictionary {(rule_name, arity): rules}, each group being a
+        tuple of rules in their original order.
+        """
+        groups = {}
+        for rule in rules:
+            cond = rule.get_pattern()
+            key = (cond[0], len(cond))
+            if key in groups:
+                groups[key].append(rule)
+            else:
+                groups[key] = [rule]
+        for key, group in groups.items():
+            groups[key] = tuple(group)
+        return groups
+
+
+    def _index_rules(self, previous):
+        """Build the dispatch index of the groups of rules, reusing the entries
+        of the 'previous' rule set for the groups that did not change.
+        Returns a dictionary {(rule_name, arity): (literals, default)}, see
+        _index_group().
+        """
+        index = {}
+        for key, group in self.groups.iteritems():
+            if previous is not None and previous.groups.get(key) == group:
+                index[key] = previous.index[key]
+            else:
+                index[key] = self._index_group(group)
+        return index
+
+
+    def _index_group(self, rules):
+        """Build the dispatch index of a group of rules with the same name and
+        arity. The rules whose first argument is a number are hashed by that
+        number. Each entry lists the candidate rules in their original order,
+        so that the first matching rule is still the one fired.
+        Returns (literals, default) where 'literals' maps a first argument value
+        to its candidate rules, and 'default' lists the rules to try for any
+        other value.
+        """
+        literals = {}
+        default = []
+        for rule in rules:
+            cond = rule.get_pattern()
+            if len(cond) > 1 and isinstance(cond[1], int):
+                # A literal rule is only tried for its own value, after the
+                # variable rules defined before it.
+                if cond[1] not in literals:
+                    literals[cond[1]] = list(default)
+                literals[cond[1]].append(rule)
+            else:
+                # A variable rule is a candidate for every value
+                default.append(rule)
+                for candidates in literals.values():
+                    candidates.append(rule)
+        return literals, default
+
+
+    def candidate_rules(self, pattern):
+        """Gets the list of rules that can match the pattern, in order.
+        """
+        entry = self.index.get((pattern[0], len(pattern)))
+        if entry is None:
+            return []
+        literals, default = entry
+        if len(pattern) > 1:
+            return literals.get(pattern[1], default)
+        return default
+
+
+    def unchanged_groups(self, previous):
+        """Gets the groups of rules whose calls give the same results with the
+        'previous' rule set: their rules did not change, nor the rules they
+        call, directly or not.
+        Returns the set of their (rule_name, arity).
+        """
+        keys = set(self.groups)
+        keys.update(previous.groups)
+        calls = {}
+        changed = []
+        for key in keys:
+            group = self.groups.get(key)
+            if group != previous.groups.get(key):
+                changed.append(key)
+            for rule in group or ():
+                for item in rule.get_body():
+                    if isinstance(item, tuple):
+                        calls.setdefault((item[0], len(item)), set()).add(key)
+        # The callers of a changed group change too
+        unchanged = keys
+        while changed:
+            key = changed.pop()
+            if key in unchanged:
+                unchanged.remove(key)
+                changed.extend(calls.get(key, ()))
+        return unchanged
+
+
+    def _interpret_call(self, pattern):
+        """Evaluate a single rule call with the interpreter.
+        Used by the compiled rules to call the rules that could not be compiled.
+        The interpreter belongs to the rule set, as the rule set can be shared by
+        many TimeWriters.
+        """
+        if self._interpreter is None:
+            self._interpreter = TimeWriter(compiled=False, rule_set=_RuleSet(self.rules, False))
+        return self._interpreter._interpret_call(pattern)
+
+
+    def memory_size(self):
+        """Gets the memory size in bytes of the rule set: its rules, dispatch
+        index and compiled functions, with their source, and the rule set and
+        memo of the interpreter of the rules which could not be compiled.
+        """
+        seen = set()
+        size = sys.getsizeof(self)
+        for part in (self.rules, self.groups, self.index, self.codes, self.functions):
+            size += _deep_size(part, seen)
+        interpreter = self._interpreter
+        if interpreter is not None:
+            rule_set, memo = interpreter._state
+            size += _deep_size(rule_set.groups, seen) + _deep_size(rule_set.index, seen)
+            if memo is not None:
+                size += _deep_size(memo._items, seen)
+        return size
+
+
+class _TimesFile:
+    """The times of the day written by many languages, read from a binary file
+    mapped in memory, so that the processes using it share its pages and no rule
+    is parsed.
+
+    The index of a language lists 2 * 24 * 60 + 1 offsets in the file: the time
+    i = hour * 60 + minute is written with markup between the offsets 2 * i and
+    2 * i + 1, and as plain text between the offsets 2 * i + 1 and 2 * i + 2.
+    The texts are UTF-8 encoded.
+    """
+
+
+    def __init__(self, path):
+        """Map the file in memory.
+        Raises EnvironmentError if the file can't be read, or ValueError if it is
+        not a times file.
+        """
+        f = open(path, "rb")
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            magic, version, count = _TIMES_HEADER.unpack_from(self._map, 0)
+            if magic != _TIMES_MAGIC or version != _TIMES_VERSION:
+                raise ValueError("%s is not a times file" % path)
+            self.languages = {}
+            self._indexes = {}
+            for i in range(count):
+                name, digest, index = _TIMES_ENTRY.unpack_from(self._map, _TIMES_HEADER.size + i * _TIMES_ENTRY.size)
+                self.languages[name.rstrip("\0")] = index
+                self._indexes[digest] = index
+        except struct.error:
+            raise ValueError("%s is truncated" % path)
+
+
+    def find(self, source):
+        """Gets the index of the times written by a rules source, or None if the
+        file doesn't have them.
+        """
+        return self._indexes.get(_rules_digest(source))
+
+
+    def get(self, index, hour, minute):
+        """Gets the time written with markup, from the index of a language.
+        """
+        start, end = _TIMES_TEXTS.unpack_from(self._map, index + (hour * 60 + minute) * 8)[:2]
+        return self._map[start:end]
+
+
+    def get_texts(self, index, hour, minute):
+        """Gets the time written with and without markup, from the index of a
+        language.
+        Returns (markup, text).
+        """
+        start, middle, end = _TIMES_TEXTS.unpack_from(self._map, index + (hour * 60 + minute) * 8)
+        return self._map[start:middle], self._map[middle:end]
+
+
 class TimeWriter:
     """A class to print the time in natural language.
     """
 
 
-    def __init__(self):
+    def __init__(self, precompute=False, cache_dir=None, compiled=True, memo_size=1024,
+                 instrument=False, rule_set=None, times_file=None):
         """Create a time writer for the current language.
         The rules localized for a language are stored in the localized messages file.
+        When 'precompute' is True, all the times of the day are written once, on
+        the first call to write_time(), and then read from a table.
+        When 'cache_dir' is given, the parsed rules are saved in that directory and
+        read back the next time, instead of parsing the rules again.
+        When 'compiled' is True, the rules are translated to Python functions;
+        otherwise they are interpreted.
+        The results of the last 'memo_size' interpreted rule calls are remembered,
+        as they only depend on the call arguments. Use 0 to disable the memo.
+        When 'instrument' is True, the rules are interpreted and each rule counts
+        how many times it was tried and matched, and the time spent writing its
+        body. Read the counters with rule_stats(). The memo is then disabled, so
+        that every rule call is counted.
+        When 'rule_set' is given, the TimeWriter uses that _RuleSet, maybe shared
+        with other TimeWriters, instead of the rules of the current language.
+        When 'times_file' is the path of a file built by build_times_file() with
+        the rules of the current language, the times of the day are read from
+        that file, and the rules are only parsed when another method needs them.
+        By default, the times file built by build_locale_times() for the current
+        translation is used. A missing or invalid file is ignored.
+
+        A TimeWriter can write times from many threads at once, even while its
+        rules are changed: each call uses the rules set when it started.
         """
-        self._rules = self.parse_rules(self._time_rules)
+        self._precompute = precompute
+        self._compiled = compiled and not instrument
+        self._instrument = instrument
+        if instrument:
+            # Only the instrumented TimeWriters pay for the counters
+            self._match_pattern = self._match_pattern_stats
+        self._memo_size = memo_size
+        if instrument:
+            self._memo_size = 0
+        self._cache_dir = cache_dir
+        # (rule_set, table, table_info) of the precomputed times
+        self._table = None
+        # (rule_set, cache) of the times written with and without markup
+        self._texts = None
+        # The rules parsed by set_rules(), by their text
+        self._rule_texts = {}
+        # (times_file, index) of the times read from a times file
+        self._times = None
+        # (rule_set, memo) of the current rules, see _get_state()
+        self._state = None
+        if rule_set is not None:
+            self._use_rule_set(rule_set)
+            return
+        if times_file is None:
+            times_file = _locale_times_file()
+        if times_file is not None and not instrument:
+            self._times = self._open_times(times_file, self._time_rules)
+        if self._times is None:
+            self._load_rules(self._time_rules)
+
+
+    def _get_state(self):
+        """Gets the (rule_set, memo) of the current rules. A TimeWriter reading
+        its times from a times file parses the rules of the current language
+        when they are first needed.
+        """
+        state = self._state
+        if state is None:
+            times = self._times
+            self._load_rules(self._time_rules)
+            # The rules are the ones of the times file
+            self._times = times
+            state = self._state
+        return state
+
+
+    def _open_times(self, path, source):
+        """Gets the (times_file, index) of the times written by the rules source
+        in a times file, or None if the file is missing, invalid or doesn't have
+        them.
+        """
+        try:
+            times_file = _TimesFile(path)
+        except (EnvironmentError, ValueError):
+            return None
+        index = times_file.find(source)
+        if index is None:
+            return None
+        return times_file, index
 
 
     # TRANS: The rules to print the time in the localized language.
@@ -172,7 +1842,7 @@ class TimeWriter:
     # and call the rule matching am_pm(h).
     # Internal spaces are significant on the right side of a rule. In calls, all
     # arguments which are not numbers are considered to be variables. The rule parser
-    # is very simple and will let many syntax errors go ignored.
+    # reports syntax errors with their line and column in the rules.
     #
     # A rule ends with the character '|'.
     # The character '_' is a anonymous variable.
@@ -183,6 +1853,12 @@ class TimeWriter:
     # Use '\#' to use a # character, for instance in a pango color
     # tag like <span foreground="\#FF0055">
     #
+    # The arguments of the calls in the right hand side can be computed with the
+    # operators + - * / (integer division) and %, from the variables of the left hand
+    # side. * / and % are computed before + and -. For instance:
+    #     next_hour(23) => midnight |
+    #     next_hour(h) => hour(h + 1) |
+    #
     # You can put range conditions on firing a rule, with the syntax [var1 < var2] or
     # [var1 < var2 < var3]. For instance:
     #     hours(h) [h < 12] => in the morning |
@@ -204,25 +1880,20 @@ class TimeWriter:
     _time_rules = _("""time(h, m) => What Time Is It?""")
 
 
-    def _syntax_error(self, rule):
-        """Print an error message when a rule can't be parsed.
-        """
-        raise SyntaxError("Syntax error in rule: %s" % rule)
-    
-    
     def print_rules(self):
         """Print the list of rules. Can be used to check the parser.
         """
+        rules = self._get_state()[0].rules
         print "Rules = ["
-        for i, rule in enumerate(self._rules):
+        for i, rule in enumerate(rules):
             print "#%d %s" % (i, rule)
-        print "]\nTotal = %d rules\n" % len(self._rules)
+        print "]\nTotal = %d rules\n" % len(rules)
     
     
     def repr_rules(self):
         """Gets the external representation of the rules.
         """
-        return " |\n".join(repr(rule) for rule in self._rules)
+        return " |\n".join(repr(rule) for rule in self._get_state()[0].rules)
     
     
     def parse_rules(self, source):
@@ -230,119 +1901,385 @@ class TimeWriter:
         Rules are a list of rule definitions separated by |.
             Rules := Rule ( '|' Rule )*
         Returns the list of rules.
+        Raises SyntaxError with the position of the first error.
         """
-        self._rules = []
-        for rule in source.split("|"):
-            r = self._parse_rule(rule)
-            self._rules.append(r)
-        return self._rules
-    
-    
-    def _parse_rule(self, source):
-        """Parse a single rule.
-        A rule is composed of a pattern and a body, separated by =>.
-            Rule := Pattern_call Range_condition* '=>' Rule_body
-        Return a rule definition object.
+        rules = _RuleParser(source).parse_rules()
+        self._use_rules(rules)
+        return rules
+
+
+    def _use_rules(self, rules):
+        """Make the parsed rules the current set of rules.
         """
-        r = re.findall(r"\s*(\w+\s*\(.*?\))\s*(\[.*\])?\s*=>(.*)", source)
-        if r[0] is None or r[0][0] == "" or r[0][2] == "":
-            self._syntax_error(rule)
-        pattern_call = self._parse_call(r[0][0])
-        range_conditions = self._parse_ranges(r[0][1])
-        rule_body = self._parse_body(r[0][2].strip())
-        rule = _Rule(pattern_call, range_conditions, rule_body)
-        return rule
-    
-    
-    def _parse_call(self, source):
-        """Parse a rule pattern or call.
-        A rule call is similar to a function call.
-            Rule_call := Rule_name '(' ( arg [',' arg]* ) ')'
-        Returns a list [Rule_name, arg1, arg2...]
-        """
-        src = cStringIO.StringIO(source).readline
-        src = tokenize.generate_tokens(src)
-        token = src.next()
-        if token[0] is not tokenize.NAME:
-             self._syntax_error(source)
-        call = [token[1]]
-        token = src.next()
-        if token[1] != "(":
-             self._syntax_error(source)
-        token = src.next()
-        while token[1] != ")":
-            try:
-                call.append(int(token[1]))
-            except ValueError:
-                call.append(token[1])
-            token = src.next()
-            if token[1] == ",":
-                token = src.next()
-        return call
+        self._use_rule_set(_RuleSet(rules, self._compiled))
 
 
-    def _parse_ranges(self, source):
-        """Parse zero or many range conditions.
-            Range_conditions := Range_condition*
-            Range_condition := '[' arg1 '<' arg2 ('<' arg3)? ']'
-        Returns a list [[arg11, arg12], [arg21, arg22, arg23]...]
+    def _use_rule_set(self, rule_set, previous=None):
+        """Make the rules of a _RuleSet the current set of rules.
+        'previous' is the (rule_set, memo) of the rules replaced by the new
+        ones: the memo entries and the precomputed times which don't depend on
+        the changed rules are kept.
         """
-        if source == "":
-            return None
+        if rule_set.compiled != self._compiled:
+            rule_set = _RuleSet(rule_set.rules, self._compiled)
+        # The times file has the times of other rules
+        self._times = None
+        if self._instrument:
+            self._stats = dict((id(rule), [0, 0, 0.0]) for rule in rule_set.rules)
+        # The memo of the previous rules may still be used by running calls
+        memo = None
+        if previous is not None:
+            unchanged = rule_set.unchanged_groups(previous[0])
+            if previous[1] is not None:
+                memo = previous[1].copy(self._memo_size, lambda key: (key[0], len(key)) in unchanged)
+            if ("time", 3) in unchanged:
+                table = self._table
+                if table is not None and table[0] is previous[0]:
+                    self._table = (rule_set,) + table[1:]
+                texts = self._texts
+                if texts is not None and texts[0] is previous[0]:
+                    self._texts = (rule_set, texts[1])
+        elif self._memo_size > 0:
+            memo = _LRUCache(self._memo_size)
+        # A single assignment, so that the calls see either the old rules and
+        # memo, or the new ones. The table of times remembers its rules.
+        self._state = (rule_set, memo)
+
+
+    def _load_rules(self, source):
+        """Gets the parsed rules from the cache directory, or parse them and save
+        them in the cache.
+        The cache file name is a hash of the rules source and the cache format
+        version, so that a changed translation is parsed again.
+        The rules with a syntax error are skipped with a warning, so that a
+        translation with a broken rule can still write most of the times; use
+        validate_rules() or "--check-po" to report them.
+        Returns the list of rules.
+        """
+        if self._cache_dir is None:
+            return self._parse_translation(source)
+        if isinstance(source, unicode):
+            source = source.encode("utf-8")
+        digest = hashlib.sha1("%d\n%s" % (_CACHE_VERSION, source)).hexdigest()
+        path = os.path.join(self._cache_dir, "timewriter-%s.cache" % digest)
+        rules = self._read_cache(path)
+        if rules is None:
+            rules = self._parse_translation(source)
+            self._write_cache(path, rules)
         else:
-            ranges = []
-            for r in re.findall(r"\[\s*(.*?)\s*<\s*(.*?)\s*(?:<\s(.*?))?\s*\]", source):
-                rang = []
-                for x in r:
-                    if x != "":
-                        try:
-                            rang.append(int(x))
-                        except ValueError:
-                            rang.append(x)
-                ranges.append(rang)
-            return ranges
+            self._use_rules(rules)
+        return rules
+
+
+    def _parse_translation(self, source):
+        """Parse the rules of a translation, skipping the rules with a syntax
+        error with a warning.
+        Returns the list of rules.
+        """
+        rules = _parse_translation_rules(source)
+        self._use_rules(rules)
+        return rules
+
+
+    def _read_cache(self, path):
+        """Read the parsed rules from a cache file.
+        Returns the list of rules, or None if the file is missing or unreadable.
+        """
+        try:
+            f = open(path, "rb")
+            try:
+                version, rules = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            # Missing, truncated or incompatible cache file
+            return None
+        if version != _CACHE_VERSION:
+            return None
+        return rules
+
+
+    def _write_cache(self, path, rules):
+        """Save the parsed rules in a cache file.
+        The file is written under a temporary name and then renamed, so that
+        another instance never reads a partial file. Errors are ignored, as the
+        rules can always be parsed again.
+        """
+        try:
+            if not os.path.isdir(self._cache_dir):
+                os.makedirs(self._cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir)
+            f = os.fdopen(fd, "wb")
+            try:
+                cPickle.dump((_CACHE_VERSION, rules), f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
 
 
     def _parse_body(self, source):
         """Parse the right hand side of a rule.
-        We must preserve spaces in the rule body, so we use regular expression for parsing.
-            Rule_body := text? Pattern_call? Rule_body?
-        Returns a list [text, (pattern, arg1, arg2...), text, ...]
-        '#' is a concatenation operator if not escaped by '\'
+        Returns a tuple (text, (pattern, arg1, arg2...), text, ...)
         """
-        if not re.search(r"(\w+\s*\(.*?\))", source):
-            # No rull call present
-            return [source]
-        else:
-            body = []
-            text = ""
-            escaped = False
-            for item in re.findall(r"(?:(\w+\s*\(.*?\))|(.))", source):
-                if item[0] != "":
-                    if text != "":
-                        body.append(text)
-                        text = ""
-                    body.append(self._parse_call(item[0]))
-                else:
-                    if item[1] == "\\":
-                        escaped= True
-                    elif item[1] == "#":
-                        if escaped:
-                            text += item[1]
-                            escaped = False
-                    else:
-                        text += item[1]
-                        escaped = False
-            if text != "":
-                body.append(text)
-            return body
+        return _RuleParser(source).parse_body()
     
     
     def write_time(self, hour, minute):
         """Gives the natural language translation of the time.
         For instance, write_time(3, 41) returns "three hours and forty-one minutes in the morning" with an English TimeWriter.
         """
-        return self.eval_rule("time(%s, %s)" % (hour, minute))
+        times = self._times
+        if times is not None and 0 <= hour < 24 and 0 <= minute < 60:
+            return times[0].get(times[1], hour, minute)
+        rule_set, memo = self._get_state()
+        return self._write_time(hour, minute, rule_set, memo)
+
+
+    def write_time_texts(self, hour, minute):
+        """Gives the natural language translation of the time, both with its
+        Pango markup and as plain text, for instance to speak it.
+        Returns (markup, text). Both are remembered together, so that the rules
+        are evaluated and the markup removed only once for each time.
+        """
+        times = self._times
+        if times is not None and 0 <= hour < 24 and 0 <= minute < 60:
+            return times[0].get_texts(times[1], hour, minute)
+        rule_set, memo = self._get_state()
+        texts = self._texts
+        if texts is None or texts[0] is not rule_set:
+            texts = (rule_set, _LRUCache(24 * 60))
+            self._texts = texts
+        cache = texts[1]
+        result = cache.get((hour, minute))
+        if result is None:
+            markup = self._write_time(hour, minute, rule_set, memo)
+            result = (markup, _strip_markup(markup))
+            cache.put((hour, minute), result)
+        return result
+
+
+    def _write_time(self, hour, minute, rule_set, memo):
+        """Write the time with the rule set and memo of a state.
+        """
+        if self._precompute and 0 <= hour < 24 and 0 <= minute < 60:
+            text = self._get_table(rule_set)[hour * 60 + minute]
+            if text is not None:
+                return text
+            # The rules failed for this time when the table was built: write it
+            # again to raise the error
+        return "".join(self._match_pattern([("time", hour, minute)], rule_set, memo))
+
+
+    def write_times(self, times):
+        """Gives the natural language translation of many times at once.
+        'times' is an iterable of (hour, minute) pairs.
+        Returns the list of the translations, in the same order.
+        """
+        return [text for hour, minute, text in self.iter_times(times)]
+
+
+    def iter_times(self, times=None):
+        """Generates the natural language translation of many times, lazily.
+        'times' is an iterable of (hour, minute) pairs, all the times from 00:00
+        to 23:59 by default.
+        Yields (hour, minute, text) tuples, in the same order.
+        """
+        if times is None:
+            times = self._all_times()
+        if self._times is not None:
+            for hour, minute in times:
+                yield hour, minute, self.write_time(hour, minute)
+            return
+        rule_set = self._get_state()[0]
+        if not self._precompute:
+            for item in self._evaluate_times(times, rule_set):
+                yield item
+            return
+        table = self._get_table(rule_set)
+        for hour, minute in times:
+            text = None
+            if 0 <= hour < 24 and 0 <= minute < 60:
+                text = table[hour * 60 + minute]
+            if text is None:
+                text = self.write_time(hour, minute)
+            yield hour, minute, text
+
+
+    def _all_times(self):
+        """Generates all the (hour, minute) pairs from 00:00 to 23:59.
+        """
+        for h in range(0, 24):
+            for m in range(0, 60):
+                yield h, m
+
+
+    def _evaluate_times(self, times, rule_set, skip_errors=False):
+        """Generates (hour, minute, text) for the (hour, minute) pairs, evaluating
+        the rules of the rule set.
+        The evaluation state is shared by the whole batch: the entry point of the
+        rules is looked up once, the same time is only written once, and the
+        sub-rule calls are remembered in a memo which is not bounded in size, as it
+        only lives as long as the batch. The instrumented TimeWriters have no memo,
+        to count all the calls.
+        When 'skip_errors' is True, a time whose rules raise an exception is
+        yielded with None as text instead of ending the batch.
+        """
+        function = rule_set.functions.get(("time", 3))
+        memo = None
+        if not self._instrument:
+            memo = _LRUCache(sys.maxint)
+        done = {}
+        for hour, minute in times:
+            text = done.get((hour, minute))
+            if text is None and (hour, minute) not in done:
+                try:
+                    if function is not None:
+                        text = function(hour, minute)
+                    else:
+                        text = "".join(self._match_pattern([("time", hour, minute)], rule_set, memo))
+                except Exception:
+                    if not skip_errors:
+                        raise
+                done[(hour, minute)] = text
+            yield hour, minute, text
+
+
+    def _get_table(self, rule_set):
+        """Gets the table of the times written with the rule set, building it
+        if needed.
+        """
+        table = self._table
+        if table is None or table[0] is not rule_set:
+            table = self._build_table(rule_set)
+        return table[1]
+
+
+    def _build_table(self, rule_set):
+        """Write all the times from 00:00 to 23:59 in a table indexed by
+        hour * 60 + minute. The times which the rules fail to write are None in
+        the table, so that only them raise the error when they are written.
+        Returns (rule_set, table, table_info).
+        """
+        start = time.time()
+        table = [text for hour, minute, text in
+                 self._evaluate_times(self._all_times(), rule_set, skip_errors=True)]
+        size = sys.getsizeof(table)
+        for text in set(table):
+            if text is not None:
+                size += sys.getsizeof(text)
+        # The table may be built by many threads at once; they build the same
+        self._table = (rule_set, table, {"build_time": time.time() - start, "size": size})
+        return self._table
+
+
+    def table_info(self):
+        """Gets the statistics of the precomputed table of times.
+        Returns a dictionary with the time taken to build the table in seconds
+        ("build_time") and its memory size in bytes ("size"), or None if the
+        table has not been built for the current rules.
+        """
+        table = self._table
+        if table is None or table[0] is not self._get_state()[0]:
+            return None
+        return table[2]
+
+
+    def rules_info(self):
+        """Gets the statistics of the parsed rules.
+        Returns a dictionary with the number of rules ("rules") and their memory
+        size in bytes ("size"), counting once the strings shared by the rules.
+        """
+        rules = self._get_state()[0].rules
+        return {"rules": len(rules), "size": _deep_size(rules, set())}
+
+
+    def memo_info(self):
+        """Gets the statistics of the memo of rule calls.
+        Returns a dictionary with the number of "hits" and "misses" of the lookups,
+        the number of entries ("size") and the maximum number of entries
+        ("max_size"), or None if the memo is disabled.
+        """
+        memo = self._get_state()[1]
+        if memo is None:
+            return None
+        return {"hits": memo.hits, "misses": memo.misses,
+                "size": len(memo), "max_size": memo._size}
+
+
+    def rule_stats(self):
+        """Gets the counters of the rules, since they were set.
+        Returns a list of (rule, tries, hits, seconds) in the order of the rules,
+        where 'seconds' is the time spent writing the body of the rule, including
+        the rules it calls, or None if the TimeWriter is not instrumented.
+        """
+        if not self._instrument:
+            return None
+        stats = self._stats
+        return [(rule,) + tuple(stats.get(id(rule), (0, 0, 0.0))) for rule in self._get_state()[0].rules]
+
+
+    def print_rule_stats(self):
+        """Print the counters of the rules as a table.
+        """
+        stats = self.rule_stats()
+        if stats is None:
+            print "The TimeWriter is not instrumented"
+            return
+        print "%5s %8s %8s %6s %9s  %s" % ("#", "tries", "hits", "hits%", "time ms", "rule")
+        for i, (rule, tries, hits, seconds) in enumerate(stats):
+            if tries:
+                ratio = "%5.1f%%" % (100.0 * hits / tries)
+            else:
+                ratio = "-"
+            print "%5d %8d %8d %6s %9.3f  %s" % (i, tries, hits, ratio, seconds * 1000, rule)
+
+
+    def check_coverage(self):
+        """Check that the rules can write all the times from 00:00 to 23:59, and
+        all the rule calls they make, without writing them.
+        Returns a dictionary with:
+        - "errors": the list of (hour, minute, message) for each time that can't
+          be written, with the message of the error raised by write_time();
+        - "never_fired": the list of the rules never used by any time. The calls
+          made after a failed call are still checked.
+        """
+        rules = self._get_state()[0].rules
+        checker = _CoverageChecker(rules, self._bind)
+        errors = checker.check()
+        never_fired = [rule for rule in rules if id(rule) not in checker.fired]
+        return {"errors": errors, "never_fired": never_fired}
+
+
+    def optimize_rules(self):
+        """Remove the rules which can never fire and try first the rules which
+        fire most often, without changing the rule fired for any pattern.
+        When the TimeWriter is instrumented, the frequencies of the rules are the
+        counters of the rules fired until now; otherwise the rules matching more
+        values are tried first.
+        Returns the report of the optimization, see _RuleOptimizer.optimize().
+        """
+        frequencies = None
+        if self._instrument:
+            frequencies = dict((id(rule), hits) for rule, tries, hits, seconds in self.rule_stats())
+        rules, report = _RuleOptimizer(self._get_state()[0].rules).optimize(frequencies)
+        self._use_rules(rules)
+        return report
+
+
+    def print_optimization(self, report):
+        """Print the report of optimize_rules().
+        """
+        for rule in report["unsatisfiable"]:
+            print "Never true: %s" % rule
+        for rule, earlier in report["shadowed"]:
+            print "Shadowed: %s\n      by: %s" % (rule, earlier)
+        for group in report["reordered"]:
+            print "Reordered:"
+            for rule in group:
+                print "    %s" % rule
+        print "Total = %d rules" % len(self._get_state()[0].rules)
 
 
     def eval_rule(self, source):
@@ -350,120 +2287,161 @@ class TimeWriter:
         Example: eval_rule("It is time(15, 2).")
         """
         lst = self._parse_body(source)
-        # lst = [text, [call, arg1, arg2..], text, ...]
+        # lst = (text, (call, arg1, arg2..), text, ...)
         # The goal is now to flatten the list lst resolving all the calls
-        lst = self._match_pattern(lst)
+        rule_set, memo = self._get_state()
+        lst = self._match_pattern(lst, rule_set, memo)
         return "".join(lst)
     
     
-    def _match_pattern(self, patterns):
+    def _match_pattern(self, patterns, rule_set, memo):
         """Match a list of patterns agains the set of rules.
         This engine stops at the first rule matching the pattern and eventually
-        instanciates the variables, then recursively apply them in the body of the
+        binds the variables, then recursively apply them in the body of the
         matched rule.
         Returns a list with all the patterns replaced by the rules bodies infered.
         If a pattern can't be matched, the engine produces no result in the resulting
         list. As we expect the set of rules to be complete (all submitted patterns
         fire at least one rule), we raise an exception if the number of items in the
         result is not the same as the number of patters submitted.
+        The rules are the ones of 'rule_set', a _RuleSet, and the results of the
+        sub-rule calls are remembered in 'memo', an _LRUCache, unless it is None.
         """
         result = []
     
         for pattern in patterns:
-            if isinstance(pattern, list):
-                for rule in self._rules:
-                    cond = rule.get_pattern()
-    
-                    # Simple tests first
-                    if len(pattern) != len(cond):
-                        continue
-                    # Check that we test the same set of rules
-                    if pattern[0] != cond[0]:
-                        continue
-    
-                    # We use lazy rule body copy, only when there is a variable in the
-                    # pattern. I've found that I got a 50% boost in performance doing
-                    # that instead of doing the deepcopy from start.
-                    body = None
-    
-                    # Now we check that the premises match and substitute all
-                    # variables in rule body.
-                    match = True
-                    # The dictionary will keep the variable bindings
-                    bind = {}
-                    for i in range(1, len(pattern)):
-                        # Dumb variable
-                        if cond[i] == "_":
-                            continue
-    
-                        # Variable instanciation
-                        if not isinstance(cond[i], int):
-                            if body is None:
-                                body = copy.deepcopy(rule.get_body())
-                            body = self._apply_var(cond[i], pattern[i], body)
-                            bind[cond[i]] = pattern[i]
-                            continue
-    
-                        if pattern[i] != cond[i]:
-                            match = False
-                            break
-
-                    # Checking the range conditions to see if we can apply the rule
-                    ranges = rule.get_ranges()
-                    if match and ranges:
-                        ranges = copy.deepcopy(ranges)
-                        for r in ranges:
-                            # Bind all variables
-                            for i in range(0, len(r)):
-                                if not isinstance(r[i], int):
-                                    try:
-                                        r[i] = bind[r[i]]
-                                    except KeyError:
-                                        #self._syntax_error(rule)
-                                        match = False
-                                        break
-
-                            # Now check that the range is valid
-                            if r[0] >= r[1]:
-                                match = False
-                                break
-                            if len(r) > 2 and r[1] >= r[2]:
-                                match = False
-                                break
-
-                    if match:
-                        # Then we apply all the rule calls in the body of the rule
-                        # that matched
-                        if body is None:
-                            body = copy.deepcopy(rule.get_body())
-                        calls = True
-                        while calls:
-                            calls = False
-                            for i in range(0, len(body)):
-                                if isinstance(body[i], list):
-                                    body[i] = "".join(self._match_pattern([body[i]]))
-                                    calls = True
-                        result.append("".join(body))
+            if isinstance(pattern, tuple):
+                function = rule_set.functions.get((pattern[0], len(pattern)))
+                if function is not None:
+                    result.append(function(*pattern[1:]))
+                    continue
+                # The index only gives the rules with the same name and
+                # arity, and the right literal first argument.
+                for rule in rule_set.candidate_rules(pattern):
+                    bind = self._bind(rule, pattern)
+                    if bind is not None:
+                        result.append(self._write_body(rule, bind, rule_set, memo))
                         break
             else:
                 result.append(pattern)
     
         if len(result) != len(patterns):
-            raise Exception("There is a missing rule; match failed for pattern %s..." % patterns)
+            raise Exception(_MISSING_RULE % (patterns,))
     
         return result
 
 
-    def _apply_var(self, var, value, body):
-        """Instanciate a variable in the body of a rule.
-        Returns the body of the rule with that variable substituted by its value in all calls.    This function eventually changes the 'body' argument.
+    def _match_pattern_stats(self, patterns, rule_set, memo):
+        """Same as _match_pattern(), but counting for each rule the number of
+        times it is tried and matched, and the time spent writing its body,
+        including the rules it calls.
+        Replaces _match_pattern() in the instrumented TimeWriters.
+        """
+        result = []
+        stats = self._stats
+
+        for pattern in patterns:
+            if isinstance(pattern, tuple):
+                for rule in rule_set.candidate_rules(pattern):
+                    # The rules may have been changed by another thread since
+                    # the call started: their counters are gone.
+                    counters = stats.get(id(rule))
+                    if counters is None:
+                        counters = [0, 0, 0.0]
+                    counters[0] += 1
+                    bind = self._bind(rule, pattern)
+                    if bind is not None:
+                        counters[1] += 1
+                        start = time.time()
+                        result.append(self._write_body(rule, bind, rule_set, memo))
+                        counters[2] += time.time() - start
+                        break
+            else:
+                result.append(pattern)
+
+        if len(result) != len(patterns):
+            raise Exception(_MISSING_RULE % (patterns,))
+
+        return result
+
+
+    def _write_body(self, rule, bind, rule_set, memo):
+        """Write the body of a rule that matched, applying its rule calls.
+        The rule body is never modified: the calls are rebuilt with the values
+        of the bound variables.
+        """
+        text = []
+        for item in rule.get_body():
+            if isinstance(item, tuple):
+                call = (item[0],) + tuple([(_compute(arg, bind) if isinstance(arg, tuple) else bind.get(arg, arg))
+                                           for arg in item[1:]])
+                text.append(self._sub_call(call, rule_set, memo))
+            else:
+                text.append(item)
+        return "".join(text)
+
+
+    def _sub_call(self, pattern, rule_set, memo):
+        """Evaluate a rule call found in the body of a rule.
+        Its result only depends on the pattern, so it is looked for in the memo
+        first.
+        """
+        if memo is None:
+            return "".join(self._match_pattern([pattern], rule_set, memo))
+        text = memo.get(pattern)
+        if text is None:
+            text = "".join(self._match_pattern([pattern], rule_set, memo))
+            memo.put(pattern, text)
+        return text
+
+
+    def _interpret_call(self, pattern):
+        """Evaluate a single rule call with the interpreter.
+        Used by the compiled rules to call the rules that could not be compiled.
         """
-        for elem in body:
-            if isinstance(elem, list):
-                for i in range(1, len(elem)):
-                    if elem[i] == var:
-                        elem[i] = value
-        return body
+        rule_set, memo = self._get_state()
+        return "".join(self._match_pattern([pattern], rule_set, memo))
+
+
+    def _bind(self, rule, pattern):
+        """Match a pattern against the conditions of a rule.
+        Returns the dictionary of the variable bindings {variable: value} when the
+        pattern and the range conditions match, or None.
+        """
+        cond = rule.get_pattern()
+        bind = {}
+        for i in range(1, len(pattern)):
+            arg = cond[i]
+            # Dumb variable
+            if arg == "_":
+                continue
+
+            if isinstance(arg, int):
+                if pattern[i] != arg:
+                    return None
+            elif arg not in bind:
+                # Variable instanciation
+                bind[arg] = pattern[i]
+
+        # Checking the range conditions to see if we can apply the rule
+        for r in rule.get_ranges():
+            values = []
+            for arg in r:
+                if isinstance(arg, int):
+                    values.append(arg)
+                elif arg in bind:
+                    values.append(bind[arg])
+                else:
+                    # An unbound variable never matches
+                    return None
+
+            # Now check that the range is valid
+            if values[0] >= values[1]:
+                return None
+            if len(values) > 2 and values[1] >= values[2]:
+                return None
+
+        return bind
 
 
     def test_times(self):
@@ -471,52 +2449,517 @@ class TimeWriter:
         """
         print "***** Checking all times *****"
 
-        for h in range(0, 24):
-            for m in range(0, 60):
-                str = self.write_time(h, m)
-                print "time(%d, %d) -> %s" % (h, m, str)
+        for h, m, text in self.iter_times():
+            print "time(%d, %d) -> %s" % (h, m, text)
 
 
     def set_rules(self, rules_source):
         """Assign the source of rules to the timewriter instance.
-        The rules are parsed during the operation.
+        The rules are parsed during the operation. Only the rules whose text
+        changed since the last call are parsed again, and the compiled functions,
+        index entries and memo entries of the rules which don't depend on them
+        are kept, so that rules can be edited and tried again quickly.
+        Returns the list of rules.
+        Raises SyntaxError with the position of the first error.
+        """
+        # The rules of a times file, not parsed yet, are replaced without
+        # parsing them
+        previous = self._state
+        parser = _RuleParser(rules_source)
+        rules = parser.parse_rules(self._rule_texts)
+        self._rule_texts = parser.texts
+        if previous is None:
+            self._use_rules(rules)
+        else:
+            self._use_rule_set(_RuleSet(rules, self._compiled, previous[0]), previous)
+        return rules
+
+
+
+class TimeWriterRegistry:
+    """The rule sets of many languages, loaded when first used.
+    The rules of a language are read from the po/ translation files, or else
+    from the test_timewriter modules. They are parsed and compiled once, and the
+    rule set is shared by all the TimeWriters of the language. Like the rules
+    of a TimeWriter, the rules with a syntax error are skipped with a warning.
+    When the memory size of the rule sets kept exceeds the budget, the least
+    recently used languages are forgotten; the TimeWriters already created keep
+    theirs.
+    The registry can be used by many threads.
+    """
+
+
+    def __init__(self, po_dir=None, memory_budget=_REGISTRY_BUDGET):
+        """Create an empty registry.
+        'po_dir' is the directory of the translation files, po/ in the activity
+        directory by default. 'memory_budget' is the maximum size in bytes of the
+        rule sets kept, as measured by _RuleSet.memory_size(): with their compiled
+        functions, index and interpreter memo, which grows as times are written.
+        """
+        if po_dir is None:
+            po_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "po")
+        self._po_dir = po_dir
+        self._budget = memory_budget
+        # {language: [rule_set, size, tick]}
+        self._rule_sets = {}
+        # The language whose rules are used by a language: "fr_CA" uses "fr"
+        self._aliases = {}
+        self._clock = itertools.count()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.loads = self.evictions = 0
+
+
+    def get_writer(self, language, **options):
+        """Gets a new TimeWriter for a language, like "fr" or "pt_BR.UTF-8".
+        The other arguments are given to the TimeWriter constructor.
+        """
+        return TimeWriter(rule_set=self._get_rule_set(language), **options)
+
+
+    def info(self):
+        """Gets the statistics of the registry.
+        Returns a dictionary with the "languages" kept, from the most recently
+        used, their total "size" and the "memory_budget" in bytes, and the number
+        of "hits", "loads" and "evictions" of rule sets.
+        """
+        self._lock.acquire()
+        try:
+            entries = sorted(self._rule_sets.items(), key=lambda (language, entry): -entry[2])
+            self._measure()
+            # "C" is the language of the untranslated rules
+            return {"languages": [language for language, entry in entries],
+                    "size": self._size, "memory_budget": self._budget,
+                    "hits": self.hits, "loads": self.loads, "evictions": self.evictions}
+        finally:
+            self._lock.release()
+
+
+    def clear(self):
+        """Forget all the rule sets.
+        """
+        self._lock.acquire()
+        try:
+            self._rule_sets.clear()
+            self._aliases.clear()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+
+    def _get_rule_set(self, language):
+        """Gets the rule set of a language, loading it if needed.
+        """
+        self._lock.acquire()
+        try:
+            return self._get_rule_set_locked(self._normalize(language))
+        finally:
+            self._lock.release()
+
+
+    def _get_rule_set_locked(self, language):
+        """Same as _get_rule_set(), for a normalized language, with the lock of
+        the registry taken.
+        """
+        entry = self._rule_sets.get(self._aliases.get(language, language))
+        source = None
+        if entry is None:
+            key, source = self._find_rules(language)
+            self._aliases[language] = key
+            entry = self._rule_sets.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[2] = self._clock.next()
+            return entry[0]
+
+        rule_set = _RuleSet(_parse_translation_rules(source))
+        self.loads += 1
+        self._rule_sets[key] = [rule_set, 0, self._clock.next()]
+        self._evict(key)
+        return rule_set
+
+
+    def _measure(self):
+        """Measure again the size of the rule sets, whose interpreter memo grows
+        while they write times.
+        """
+        self._size = 0
+        for entry in self._rule_sets.values():
+            entry[1] = entry[0].memory_size()
+            self._size += entry[1]
+
+
+    def _evict(self, keep):
+        """Forget the least recently used rule sets until the budget is met,
+        except the rule set of the language 'keep'.
         """
-        self._rules = self.parse_rules(rules_source)
+        self._measure()
+        if self._size <= self._budget:
+            return
+        entries = sorted(self._rule_sets.items(), key=lambda (language, entry): entry[2])
+        for language, entry in entries:
+            if self._size <= self._budget:
+                break
+            if language == keep:
+                continue
+            del self._rule_sets[language]
+            self._size -= entry[1]
+            self.evictions += 1
+
+
+    def _normalize(self, language):
+        """Gets the language code of a locale name, without encoding and modifier.
+        """
+        for separator in ".@":
+            language = language.split(separator)[0]
+        return language
+
+
+    def _find_rules(self, language):
+        """Gets the source of the rules of a language. A regional language, like
+        "fr_CA", uses the rules of "fr" if it has none. Untranslated languages
+        use the English rules, like gettext, under the language name "C".
+        Returns (language, source) where 'language' is the language found.
+        """
+        candidates = [language]
+        if "_" in language:
+            candidates.append(language.split("_")[0])
+        for candidate in candidates:
+            path = os.path.join(self._po_dir, candidate + ".po")
+            if os.path.exists(path):
+                source = read_po_rules(path)
+                if source is not None:
+                    return candidate, source
+            try:
+                module = __import__("test_timewriter.%s_rules" % candidate, fromlist=["_time_rules"])
+            except ImportError:
+                continue
+            return candidate, module._time_rules
+        return "C", _TIME_RULES_MSGID
+
+
+def read_po_rules(path):
+    """Read the translated time rules from a gettext PO file.
+    Returns the rules source, or None when the rules are not translated, or the
+    translation is fuzzy and so not used by gettext.
+    """
+    f = open(path)
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+
+    msgid = None
+    msgstr = None
+    fuzzy = False
+    current = None
+    for line in lines + ["\n"]:
+        line = line.strip()
+        if line.startswith('"') and current is not None:
+            current.append(line[1:-1])
+            continue
+        if msgid is not None and msgstr is not None and not line.startswith("msgstr["):
+            # End of an entry
+            if "".join(msgid).decode("string_escape") == _TIME_RULES_MSGID:
+                source = "".join(msgstr).decode("string_escape")
+                if fuzzy or source == "":
+                    return None
+                return source
+            msgid = msgstr = current = None
+            fuzzy = False
+        if line.startswith("#,"):
+            fuzzy = "fuzzy" in line
+        elif line.startswith("msgid "):
+            msgid = current = [line[7:-1]]
+        elif line.startswith("msgstr "):
+            msgstr = current = [line[8:-1]]
+        elif not line.startswith("#"):
+            current = None
+    return None
+
+
+def validate_rules(source):
+    """Check a set of rules: parse them and prove that they write all the times
+    of the day, with TimeWriter.check_coverage().
+    Returns a dictionary with:
+    - "syntax_error": the syntax error message, or None;
+    - "rules": the number of rules;
+    - "errors": a list of (hour, minute, message, count) for each different error
+      raised while writing the times, with the first time it happened;
+    - "never_fired": the list of the rules which are never used;
+    - "duration": the time taken by the check, in seconds.
+    """
+    start = time.time()
+    report = {"syntax_error": None, "rules": 0, "errors": [], "never_fired": []}
+    writer = TimeWriter(compiled=False)
+    try:
+        writer.set_rules(source)
+    except SyntaxError, e:
+        report["syntax_error"] = str(e)
+        report["duration"] = time.time() - start
+        return report
+
+    coverage = writer.check_coverage()
+    errors = {}
+    for h, m, message in coverage["errors"]:
+        if message in errors:
+            errors[message][3] += 1
+        else:
+            errors[message] = [h, m, message, 1]
+    report["rules"] = len(writer._state[0].rules)
+    report["errors"] = sorted(tuple(error) for error in errors.values())
+    report["never_fired"] = coverage["never_fired"]
+    report["duration"] = time.time() - start
+    return report
+
+
+def write_times_file(path, languages):
+    """Write all the times of the day written by many languages in a binary
+    file, read by the TimeWriters created with the 'times_file' option.
+    'languages' is a list of (language, source) of the rules sources, which must
+    write all the times.
+    Raises an exception if a rule is missing for a time.
+    """
+    texts = []
+    for language, source in languages:
+        writer = TimeWriter()
+        writer.parse_rules(source)
+        for hour, minute in writer._all_times():
+            for text in writer.write_time_texts(hour, minute):
+                if isinstance(text, unicode):
+                    text = text.encode("utf-8")
+                texts.append(text)
+
+    size = 2 * 24 * 60
+    first_index = _TIMES_HEADER.size + len(languages) * _TIMES_ENTRY.size
+    offset = first_index + len(languages) * (size + 1) * _TIMES_OFFSET.size
+    data = [_TIMES_HEADER.pack(_TIMES_MAGIC, _TIMES_VERSION, len(languages))]
+    for i, (language, source) in enumerate(languages):
+        index = first_index + i * (size + 1) * _TIMES_OFFSET.size
+        data.append(_TIMES_ENTRY.pack(language, _rules_digest(source), index))
+    for i in range(len(languages)):
+        for text in texts[i * size:(i + 1) * size]:
+            data.append(_TIMES_OFFSET.pack(offset))
+            offset += len(text)
+        data.append(_TIMES_OFFSET.pack(offset))
+    data.extend(texts)
+
+    # Written under a temporary name, so that the running activities keep the
+    # previous file mapped
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    f = os.fdopen(fd, "wb")
+    try:
+        f.write("".join(data))
+    finally:
+        f.close()
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, path)
+
+
+def build_times_file(path, po_dir):
+    """Write the times file of the translations in the PO files of a directory,
+    and of the untranslated rules. The translations whose rules have a syntax
+    error or can't write all the times are left out: their TimeWriters parse the
+    rules, and report the errors.
+    Returns the list of the languages left out.
+    """
+    languages, left_out = _valid_po_rules(po_dir)
+    write_times_file(path, [("C", _TIME_RULES_MSGID)] + languages)
+    return left_out
+
+
+def build_locale_times(po_dir, locale_dir):
+    """Write the times file of each translation in the PO files of a directory,
+    in the directory of the language in 'locale_dir', where the TimeWriters of
+    that language look for it. Used when building the activity bundle.
+    The translations whose rules are not valid are left out.
+    Returns the list of the languages left out.
+    """
+    languages, left_out = _valid_po_rules(po_dir)
+    for language, source in languages:
+        directory = os.path.join(locale_dir, language)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_times_file(os.path.join(directory, _LOCALE_TIMES_FILE), [(language, source)])
+    return left_out
+
+
+def _valid_po_rules(po_dir):
+    """Gets the rules of the translations in the PO files of a directory which
+    write all the times.
+    Returns the list of their (language, source), and the list of the languages
+    whose rules have a syntax error or can't write all the times.
+    """
+    import glob
+
+    languages = []
+    left_out = []
+    for po_path in sorted(glob.glob(os.path.join(po_dir, "*.po"))):
+        source = read_po_rules(po_path)
+        if source is None:
+            continue
+        language = os.path.splitext(os.path.basename(po_path))[0]
+        report = validate_rules(source)
+        if report["syntax_error"] is not None or report["errors"]:
+            left_out.append(language)
+        else:
+            languages.append((language, source))
+    return languages, left_out
 
 
+def _validate_po_file(path):
+    """Validate the rules of a PO file. Used by the process pool of check_po().
+    Returns (language, report), the report being None if the rules are not
+    translated.
+    """
+    language = os.path.splitext(os.path.basename(path))[0]
+    source = read_po_rules(path)
+    if source is None:
+        return language, None
+    report = validate_rules(source)
+    # Rules can't be sent back to the main process
+    report["never_fired"] = [repr(rule) for rule in report["never_fired"]]
+    return language, report
+
+
+def check_po(po_dir, jobs=None):
+    """Validate the rules of all the translations in the PO files of a directory,
+    running the languages in a pool of 'jobs' processes (one per CPU by default).
+    Prints a report for each language.
+    Returns True if all the translated rules are valid.
+    """
+    import glob
+    import multiprocessing
+
+    paths = sorted(glob.glob(os.path.join(po_dir, "*.po")))
+    pool = multiprocessing.Pool(jobs)
+    try:
+        results = pool.map(_validate_po_file, paths)
+    finally:
+        pool.close()
+        pool.join()
+
+    valid = True
+    print "%-8s %-8s %6s %6s %6s %8s" % ("language", "status", "rules", "unused", "errors", "time")
+    for language, report in results:
+        if report is None:
+            print "%-8s %-8s" % (language, "-")
+            continue
+        if report["syntax_error"] is not None:
+            status = "syntax"
+        elif report["errors"]:
+            status = "missing"
+        else:
+            status = "ok"
+        valid = valid and status == "ok"
+        print "%-8s %-8s %6d %6d %6d %7.3fs" % (language, status, report["rules"],
+            len(report["never_fired"]), sum([e[3] for e in report["errors"]]),
+            report["duration"])
+
+    for language, report in results:
+        if report is None:
+            continue
+        if report["syntax_error"] is None and not report["errors"] and not report["never_fired"]:
+            continue
+        print "\n***** %s *****" % language
+        if report["syntax_error"] is not None:
+            print report["syntax_error"]
+        # The first errors are enough to find the missing rules
+        for h, m, message, count in report["errors"][:_CHECK_PO_ERRORS]:
+            print "time(%d, %d): %s (%d times)" % (h, m, message, count)
+        if len(report["errors"]) > _CHECK_PO_ERRORS:
+            print "... and %d other errors" % (len(report["errors"]) - _CHECK_PO_ERRORS)
+        for rule in report["never_fired"]:
+            print "Never fired: %s" % rule
+    return valid
+
 
 def main():
     """Main entry point to test rules.
     """
-    # import sys
-    if len(sys.argv) == 1:
-        print "Usage: python timewriter.py lang"
-        print "Where lang is a ISO language code (en, fr, es...)"
-        print "TimeWriter rules must be available in directory test-timewriter."
-        exit(1)
-    lang = sys.argv[1]
+    import optparse
+
+    parser = optparse.OptionParser(usage="""python timewriter.py [options] [lang [profile]]
+Where lang is a ISO language code (en, fr, es...)
+TimeWriter rules must be available in directory test_timewriter.""")
+    parser.add_option("--check-po", action="store_true", default=False,
+                      help="validate the rules of all the translations")
+    parser.add_option("--po-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "po"),
+                      help="directory of the PO files [default: %default]")
+    parser.add_option("--build-times", metavar="FILE",
+                      help="write all the times of all the translations in the times file FILE")
+    parser.add_option("-j", "--jobs", type="int", default=None,
+                      help="number of processes checking the translations [default: one per CPU]")
+    parser.add_option("--stats", action="store_true", default=False,
+                      help="print how many times each rule of lang is tried and matched")
+    parser.add_option("--optimize", action="store_true", default=False,
+                      help="print the rules of lang which can't fire, and the rules to reorder")
+    options, args = parser.parse_args()
+
+    if options.check_po:
+        if not check_po(options.po_dir, options.jobs):
+            sys.exit(1)
+        return
+    if options.build_times:
+        left_out = build_times_file(options.build_times, options.po_dir)
+        print "Times written in %s" % options.build_times
+        if left_out:
+            print "Invalid rules left out: %s" % " ".join(left_out)
+        return
+    if len(args) == 0:
+        parser.print_usage()
+        sys.exit(1)
+    if len(args) > 1:
+        # Run the test again, with profiling information
+        import cProfile
+        import pstats
+        # The profile is written to a temporary file, removed once read
+        fd, profile_path = tempfile.mkstemp(suffix=".prof")
+        os.close(fd)
+        try:
+            cProfile.runctx("test_language(args[0], stats, optimize)", globals(),
+                            {"args": args, "stats": options.stats, "optimize": options.optimize},
+                            profile_path)
+            p = pstats.Stats(profile_path)
+        finally:
+            os.remove(profile_path)
+        print
+        print "***** Profiling *****"
+        p.strip_dirs().sort_stats("time", "name").print_stats(0.1)
+    else:
+        test_language(args[0], options.stats, options.optimize)
+
+
+def test_language(lang, stats=False, optimize=False):
+    """Print the rules and all the times for the test rules of a language.
+    When 'stats' is True, the counters of the rules are printed at the end.
+    When 'optimize' is True, the report of the optimization of the rules is
+    printed at the end.
+    """
     test_mod = "test_timewriter." + lang + "_rules"
     import_mod = "from " + test_mod + " import _time_rules as test_rules"
     exec import_mod
-    w = TimeWriter()
+    w = TimeWriter(instrument=stats)
     w.set_rules(test_rules)
     print "***** Rules parsed *****"
     w.print_rules()
     w.test_times()
+    if stats:
+        print
+        print "***** Rules statistics *****"
+        w.print_rule_stats()
+    if optimize:
+        print
+        print "***** Rules optimization *****"
+        w.print_optimization(w.optimize_rules())
 
 
 # Run "$ python timewriter.py en" to check all rules for English ("en" argument)
 # Run "$ python timewriter.py en 1" to get profiling information.
+# Run "$ python timewriter.py --stats en" to see how often each rule is used.
+# Run "$ python timewriter.py --optimize en" to find the rules which can't fire.
+# Run "$ python timewriter.py --check-po" to check the rules of all the translations.
+# Run "$ python timewriter.py --build-times timewriter.times" to write all the times.
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 2:
-        import cProfile
-        cProfile.run("main()", "genprof")
-        import pstats
-        p = pstats.Stats("genprof")
-        print
-        print "***** Profiling *****"
-        p.strip_dirs().sort_stats("time", "name").print_stats(0.1)
-    else:
-        main()
-
+    main()